@@ -0,0 +1,182 @@
+"""
+Content addressed cache for gateware build outputs.
+
+The cache key covers everything which influences the bitstream;
+
+ * the platform / target / cpu / option tuple from the command line,
+ * the generated HDL, constraint and memory init files in the gateware
+   directory,
+ * any extra HDL sources added to the platform (VHDL cores, etc),
+ * the toolchain version.
+
+On a hit the bitstream files are copied out of the cache, otherwise the
+toolchain is run as normal and the results are stored afterwards.
+"""
+
+import hashlib
+import os
+import shutil
+import subprocess
+
+
+# Files written by the toolchain which are worth keeping.
+GATEWARE_OUTPUTS = (".bit", ".bin")
+
+# Files written *before* the toolchain runs (ie the toolchain inputs).
+# migen writes the contents of each Memory (ROM with the BIOS, SRAM, ...)
+# to a .init file read by $readmemh.
+GATEWARE_INPUTS = (
+    ".v", ".vhd", ".vhdl", ".ucf", ".xdc", ".pcf", ".lpf", ".sdc", ".prj",
+    ".ys", ".tcl", ".xst", ".ut", ".init", ".mem")
+
+# Commands used to find the version of each toolchain.
+TOOLCHAIN_VERSION_CMDS = {
+    "XilinxISEToolchain": ["xst", "-help"],
+    "XilinxVivadoToolchain": ["vivado", "-version"],
+    "IceStormToolchain": ["nextpnr-ice40", "--version"],
+    "LatticeTrellisToolchain": ["nextpnr-ecp5", "--version"],
+}
+
+
+def get_cache_dir(args):
+    """Returns the cache directory or None if caching is disabled."""
+    cache_dir = getattr(args, "cache_dir", None)
+    if not cache_dir:
+        cache_dir = os.environ.get("LITEX_BUILD_CACHE", None)
+    if not cache_dir or cache_dir.lower() == "none":
+        return None
+    return cache_dir
+
+
+def get_toolchain_version(platform):
+    toolchain = getattr(platform, "toolchain", None)
+    name = toolchain.__class__.__name__
+    cmd = TOOLCHAIN_VERSION_CMDS.get(name, None)
+    if cmd is None:
+        return name
+    try:
+        output = subprocess.check_output(
+            cmd, stderr=subprocess.STDOUT, timeout=60)
+    except (OSError, subprocess.SubprocessError):
+        return "{} unknown".format(name)
+    lines = output.decode("utf-8", "replace").splitlines()
+    # Only the first few lines hold the version, the rest is usage
+    # information which can include dates / paths.
+    return "{} {}".format(name, " ".join(l.strip() for l in lines[:2]))
+
+
+def _hash_file(h, filename):
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1024*1024), b""):
+            h.update(chunk)
+
+
+def _hash_str(h, s):
+    h.update(s.encode("utf-8"))
+    h.update(b"\0")
+
+
+def get_option_key(args):
+    """
+    >>> import argparse
+    >>> args = argparse.Namespace(
+    ...     platform="opsis", target="hdmi2usb", cpu_type="lm32",
+    ...     cpu_variant=None, iprange="192.168.100",
+    ...     platform_option=[], target_option=[["b", "2"], ["a", "1"]],
+    ...     build_option=[])
+    >>> get_option_key(args)
+    "opsis hdmi2usb lm32 None 192.168.100 [] [('a', '1'), ('b', '2')] []"
+    """
+    parts = [
+        args.platform,
+        args.target,
+        args.cpu_type,
+        args.cpu_variant,
+        args.iprange,
+    ]
+    for options in (args.platform_option, args.target_option, args.build_option):
+        parts.append(sorted(tuple(o) for o in options))
+    return " ".join(str(p) for p in parts)
+
+
+def get_key(args, platform, gateware_dir):
+    """
+    Calculate the cache key once the HDL has been generated.
+
+    >>> import argparse, tempfile
+    >>> args = argparse.Namespace(
+    ...     platform="arty", target="base", cpu_type="vexriscv",
+    ...     cpu_variant=None, iprange="192.168.100",
+    ...     platform_option=[], target_option=[], build_option=[])
+    >>> class Platform:
+    ...     sources = []
+    >>> d = tempfile.mkdtemp()
+    >>> def write_rom(data):
+    ...     with open(os.path.join(d, "mem.init"), "w") as f:
+    ...         f.write(data)
+    >>> write_rom("00000000\\n")
+    >>> key = get_key(args, Platform(), d)
+    >>> write_rom("deadbeef\\n")
+    >>> get_key(args, Platform(), d) == key
+    False
+    >>> shutil.rmtree(d)
+    """
+    h = hashlib.sha256()
+    _hash_str(h, get_option_key(args))
+    _hash_str(h, get_toolchain_version(platform))
+
+    for fn in sorted(os.listdir(gateware_dir)):
+        if os.path.splitext(fn)[-1] not in GATEWARE_INPUTS:
+            continue
+        _hash_str(h, fn)
+        _hash_file(h, os.path.join(gateware_dir, fn))
+
+    for source in sorted(getattr(platform, "sources", [])):
+        filename = source[0]
+        _hash_str(h, os.path.basename(filename))
+        _hash_file(h, filename)
+
+    return h.hexdigest()
+
+
+def get_entry(cache_dir, key):
+    return os.path.join(cache_dir, key[:2], key)
+
+
+def restore(cache_dir, key, gateware_dir):
+    """Copy cached outputs into the gateware directory, returns True on hit."""
+    entry = get_entry(cache_dir, key)
+    if not os.path.isdir(entry):
+        return False
+    for fn in sorted(os.listdir(entry)):
+        shutil.copy2(os.path.join(entry, fn), os.path.join(gateware_dir, fn))
+    return True
+
+
+def store(cache_dir, key, gateware_dir):
+    """Save the toolchain outputs into the cache."""
+    entry = get_entry(cache_dir, key)
+    if os.path.isdir(entry):
+        return
+    outputs = [
+        fn for fn in sorted(os.listdir(gateware_dir))
+        if os.path.splitext(fn)[-1] in GATEWARE_OUTPUTS]
+    if not outputs:
+        return
+
+    # Write into a temporary directory and rename, so parallel builds never
+    # see a half written entry.
+    tmp_entry = "{}.tmp{}".format(entry, os.getpid())
+    os.makedirs(tmp_entry, exist_ok=True)
+    for fn in outputs:
+        shutil.copy2(os.path.join(gateware_dir, fn), os.path.join(tmp_entry, fn))
+    try:
+        os.rename(tmp_entry, entry)
+    except OSError:
+        # Someone else stored the same entry first.
+        shutil.rmtree(tmp_entry)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
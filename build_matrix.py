@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Build many PLATFORM / TARGET / CPU combinations in parallel.
+
+Combinations are given as "FULL_PLATFORM TARGET FULL_CPU" (the same format
+used by .travis/build.sh), either on the command line or one per line in a
+matrix file. Each combination is elaborated and built in its own process
+using the same functions (and build directories) as make.py.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import time
+import traceback
+
+import make
+
+
+def split_full(full):
+    """
+    >>> split_full("opsis.tofe_lowspeedio")
+    ('opsis', 'tofe_lowspeedio')
+    >>> split_full("lm32")
+    ('lm32', None)
+    """
+    if "." in full:
+        part, extra = full.split(".", 1)
+        return part, extra
+    return full, None
+
+
+def get_combination_argv(combination):
+    """
+    >>> get_combination_argv("arty base vexriscv")
+    ['--platform', 'arty', '--target', 'base', '--cpu-type', 'vexriscv']
+    >>> get_combination_argv("opsis.tofe_lowspeedio hdmi2usb lm32.lite")
+    ['--platform', 'opsis', '--target', 'hdmi2usb', '--cpu-type', 'lm32', '--cpu-variant', 'lite', '-Ot', 'expansion', 'tofe_lowspeedio']
+    """
+    full_platform, target, full_cpu = combination.split()
+    platform, expansion = split_full(full_platform)
+    cpu, cpu_variant = split_full(full_cpu)
+
+    argv = ["--platform", platform, "--target", target, "--cpu-type", cpu]
+    if cpu_variant:
+        argv += ["--cpu-variant", cpu_variant]
+    if expansion:
+        argv += ["-Ot", "expansion", expansion]
+    return argv
+
+
+def read_matrix(filename):
+    combinations = []
+    with open(filename) as f:
+        for l in f.readlines():
+            l = l.split("#", 1)[0].strip()
+            if not l:
+                continue
+            combinations.append(" ".join(l.split()))
+    return combinations
+
+
+def get_toolchain_name(platform):
+    toolchain = getattr(platform, "toolchain", None)
+    if toolchain is None:
+        return "unknown"
+    name = toolchain.__class__.__name__.lower()
+    for short in ("ise", "vivado", "icestorm", "trellis", "verilator"):
+        if short in name:
+            return short
+    return name
+
+
+def build_one(combination, argv, results):
+    """Worker process; build a single combination."""
+    result = {
+        "combination": combination,
+        "status": "failed",
+        "elaborate": None,
+        "build": None,
+    }
+    try:
+        args = make.get_parser().parse_args(argv)
+        builddir = make.get_builddir(args)
+        result["builddir"] = builddir
+        os.makedirs(builddir, exist_ok=True)
+        logfile = os.path.join(builddir, "output.matrix.log")
+        result["log"] = logfile
+
+        log = open(logfile, "w", buffering=1)
+        sys.stdout = sys.stderr = log
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+
+        start = time.time()
+        platform = make.get_platform(args)
+        soc = make.get_soc(args, platform)
+        result["elaborate"] = time.time() - start
+
+        start = time.time()
+        cache_dir = make.build_cache.get_cache_dir(args)
+        if cache_dir and not args.no_compile_gateware:
+            soc, vns = make.build_cached(args, platform, soc, cache_dir)
+        else:
+            vns = make.build(args, platform, soc)
+        make.export(args, soc, vns)
+        result["build"] = time.time() - start
+
+        result["status"] = "ok"
+    except BaseException as e:
+        result["error"] = "{}: {}".format(e.__class__.__name__, e)
+        traceback.print_exc()
+    results.put(result)
+
+
+class Job:
+    def __init__(self, combination, argv):
+        self.combination = combination
+        self.argv = argv
+        self.toolchain = None
+        self.process = None
+        self.start = None
+
+
+def schedule(jobs, max_jobs, toolchain_jobs, results):
+    """Run jobs, at most max_jobs at once and toolchain_jobs per toolchain."""
+    pending = list(jobs)
+    running = []
+    finished = []
+
+    def toolchain_running(toolchain):
+        return len([j for j in running if j.toolchain == toolchain])
+
+    while pending or running:
+        for job in list(pending):
+            if len(running) >= max_jobs:
+                break
+            limit = toolchain_jobs.get(job.toolchain, max_jobs)
+            if toolchain_running(job.toolchain) >= limit:
+                continue
+            pending.remove(job)
+            job.start = time.time()
+            job.process = multiprocessing.Process(
+                target=build_one, args=(job.combination, job.argv, results))
+            job.process.start()
+            running.append(job)
+            print("[{:3d}/{:3d}] Started  {} ({})".format(
+                len(finished)+len(running), len(jobs), job.combination, job.toolchain))
+
+        try:
+            result = results.get(timeout=1)
+        except queue.Empty:
+            result = None
+
+        if result is not None:
+            job = [j for j in running if j.combination == result["combination"]][0]
+        else:
+            # Catch workers which died without reporting anything.
+            dead = [j for j in running if j.process.exitcode is not None]
+            if not dead:
+                continue
+            job = dead[0]
+            result = {
+                "combination": job.combination,
+                "status": "failed",
+                "error": "worker exited with {}".format(job.process.exitcode),
+            }
+
+        job.process.join()
+        running.remove(job)
+        result["toolchain"] = job.toolchain
+        result["total"] = time.time() - job.start
+        finished.append(result)
+        print("[{:3d}/{:3d}] Finished {} - {} in {:.1f}s".format(
+            len(finished), len(jobs), job.combination, result["status"], result["total"]))
+
+    return finished
+
+
+def print_summary(finished):
+    print()
+    print("{:50s} {:10s} {:>10s} {:>10s} {:>10s}  {}".format(
+        "Combination", "Toolchain", "Elaborate", "Build", "Total", "Status"))
+    print("-"*100)
+    for r in finished:
+        print("{:50s} {:10s} {:>10s} {:>10s} {:>10.1f}  {}".format(
+            r["combination"],
+            r["toolchain"],
+            "-" if r.get("elaborate") is None else "{:.1f}".format(r["elaborate"]),
+            "-" if r.get("build") is None else "{:.1f}".format(r["build"]),
+            r["total"],
+            r["status"] if r["status"] == "ok" else "{} ({})".format(r["status"], r.get("error", ""))))
+    print("-"*100)
+    failed = len([r for r in finished if r["status"] != "ok"])
+    print("{} combinations, {} failed".format(len(finished), failed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("combination", nargs="*",
+                        help="\"FULL_PLATFORM TARGET FULL_CPU\" to build")
+    parser.add_argument("--matrix", default=None,
+                        help="file with one combination per line")
+    parser.add_argument("-j", "--jobs", type=int, default=multiprocessing.cpu_count(),
+                        help="number of combinations to build at once")
+    parser.add_argument("--toolchain-jobs", default=[], nargs=2, action="append",
+                        metavar=("TOOLCHAIN", "JOBS"),
+                        help="limit concurrent builds using a toolchain (ise, vivado, icestorm, ...)")
+    parser.add_argument("--summary", default="build/matrix-summary.json",
+                        help="where to write the json summary")
+
+    args, extra_argv = parser.parse_known_args()
+
+    combinations = list(args.combination)
+    if args.matrix:
+        combinations += read_matrix(args.matrix)
+    assert combinations, "No combinations given!"
+
+    toolchain_jobs = {t.lower(): int(n) for t, n in args.toolchain_jobs}
+
+    jobs = []
+    for combination in combinations:
+        job = Job(combination, get_combination_argv(combination) + extra_argv)
+        platform = make.get_platform(make.get_parser().parse_args(job.argv))
+        job.toolchain = get_toolchain_name(platform)
+        jobs.append(job)
+
+    results = multiprocessing.Queue()
+    finished = schedule(jobs, max(1, args.jobs), toolchain_jobs, results)
+
+    print_summary(finished)
+
+    summary_dir = os.path.dirname(args.summary)
+    if summary_dir:
+        os.makedirs(summary_dir, exist_ok=True)
+    with open(args.summary, "w") as f:
+        json.dump(finished, f, indent=2, sort_keys=True)
+    print("Summary: {}".format(args.summary))
+
+    if [r for r in finished if r["status"] != "ok"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
+    main()
@@ -0,0 +1,255 @@
+"""
+Elaboration checkpoints; run the vendor toolchain without re-elaborating.
+
+`make.py --checkpoint` elaborates the SoC, writes the HDL, constraints and
+software as normal (without running the toolchain) and then saves a
+checkpoint directory holding;
+
+ * the toolchain input files (top.v, top.ucf / top.xdc, top.prj, ...),
+ * the memory init files (*.init) with the ROM (BIOS) / SRAM contents,
+ * csr.csv and csr.json,
+ * checkpoint.json with the options, constants, memory regions and the
+   toolchain settings needed to run the toolchain later.
+
+`make.py --from-checkpoint DIR` then only runs the toolchain, so timing
+retries (different seeds, options or strategies) don't pay for
+elaboration again, and many of them can run in parallel from a single
+checkpoint.
+"""
+
+import json
+import os
+import shutil
+import subprocess
+
+import build_cache
+
+
+CHECKPOINT_FILE = "checkpoint.json"
+CHECKPOINT_SCRIPT = "build_checkpoint.sh"
+
+# Toolchain attributes which are needed to regenerate the build script.
+TOOLCHAIN_OPTIONS = (
+    "xst_opt", "ngdbuild_opt", "map_opt", "par_opt", "bitgen_opt",
+    "build_template",
+)
+
+
+# Shell script templates used to run each toolchain from a checkpoint. The
+# ISE flow matches the one LiteX generates, but the options come from the
+# checkpoint (and so can be overridden).
+TOOLCHAIN_SCRIPTS = {
+    "XilinxISEToolchain": """\
+set -e
+xst -ifn {build_name}.xst
+ngdbuild {ngdbuild_opt} -uc {build_name}.ucf {build_name}.ngc {build_name}.ngd
+map {map_opt} -o {build_name}_map.ncd {build_name}.ngd {build_name}.pcf
+par {par_opt} {build_name}_map.ncd {build_name}.ncd {build_name}.pcf
+bitgen {bitgen_opt} {build_name}.ncd {build_name}.bit
+""",
+    "XilinxVivadoToolchain": """\
+set -e
+vivado -mode batch -source {build_name}.tcl
+""",
+}
+
+
+def _get_toolchain_options(platform):
+    options = {}
+    for name in TOOLCHAIN_OPTIONS:
+        value = getattr(platform.toolchain, name, None)
+        if value is None:
+            continue
+        if isinstance(value, (list, tuple)):
+            value = list(value)
+        options[name] = value
+    return options
+
+
+def _get_mem_regions(soc):
+    regions = {}
+    for name, region in getattr(soc, "mem_regions", {}).items():
+        regions[name] = {
+            "origin": getattr(region, "origin", None),
+            "size": getattr(region, "size", getattr(region, "length", None)),
+        }
+    return regions
+
+
+def get_files(gateware_dir):
+    """
+    The files of the gateware directory the toolchain needs.
+
+    >>> import tempfile
+    >>> d = tempfile.mkdtemp()
+    >>> for fn in ("top.v", "top.ucf", "mem.init", "mem_1.init", "top.bit",
+    ...            "build_top.sh", CHECKPOINT_SCRIPT):
+    ...     open(os.path.join(d, fn), "w").close()
+    >>> get_files(d)
+    ['build_top.sh', 'mem.init', 'mem_1.init', 'top.ucf', 'top.v']
+    >>> shutil.rmtree(d)
+    """
+    # LiteX writes the scripts for some toolchains (icestorm, trellis)
+    # without running them, so keep those too.
+    files = []
+    for fn in sorted(os.listdir(gateware_dir)):
+        if os.path.splitext(fn)[-1] not in build_cache.GATEWARE_INPUTS + (".sh",):
+            continue
+        if fn == CHECKPOINT_SCRIPT:
+            continue
+        files.append(fn)
+    return files
+
+
+def write(args, platform, soc, gateware_dir, testdir, checkpoint_dir):
+    """Save a checkpoint after the SoC was built with run=False."""
+    if os.path.exists(checkpoint_dir):
+        shutil.rmtree(checkpoint_dir)
+    os.makedirs(checkpoint_dir)
+
+    files = get_files(gateware_dir)
+    for fn in files:
+        shutil.copy2(os.path.join(gateware_dir, fn), os.path.join(checkpoint_dir, fn))
+
+    for fn in ("csr.csv", "csr.json"):
+        if os.path.exists(os.path.join(testdir, fn)):
+            shutil.copy2(os.path.join(testdir, fn), os.path.join(checkpoint_dir, fn))
+
+    toolchain = platform.toolchain.__class__.__name__
+    metadata = {
+        "options": build_cache.get_option_key(args),
+        "platform": platform.name,
+        "device": platform.device,
+        "toolchain": toolchain,
+        "toolchain_version": build_cache.get_toolchain_version(platform),
+        "toolchain_options": _get_toolchain_options(platform),
+        "build_name": "top",
+        "files": files,
+        "sources": sorted(s[0] for s in getattr(platform, "sources", [])),
+        "constants": {k: v for k, v in getattr(soc, "constants", {}).items()},
+        "mem_regions": _get_mem_regions(soc),
+        "key": build_cache.get_key(args, platform, gateware_dir),
+    }
+    with open(os.path.join(checkpoint_dir, CHECKPOINT_FILE), "w") as f:
+        json.dump(metadata, f, indent=2, sort_keys=True, default=str)
+    return metadata
+
+
+def read(checkpoint_dir):
+    with open(os.path.join(checkpoint_dir, CHECKPOINT_FILE)) as f:
+        return json.load(f)
+
+
+def get_script(metadata, overrides=None):
+    """
+    >>> metadata = {
+    ...     "toolchain": "XilinxISEToolchain",
+    ...     "build_name": "top",
+    ...     "files": [],
+    ...     "toolchain_options": {
+    ...         "xst_opt": "", "ngdbuild_opt": "", "map_opt": "-ol high -w",
+    ...         "par_opt": "-ol high -w", "bitgen_opt": "-g Binary:Yes -w"},
+    ... }
+    >>> print(get_script(metadata, {"par_opt": "-ol high -w -t 4"}))
+    set -e
+    xst -ifn top.xst
+    ngdbuild  -uc top.ucf top.ngc top.ngd
+    map -ol high -w -o top_map.ncd top.ngd top.pcf
+    par -ol high -w -t 4 top_map.ncd top.ncd top.pcf
+    bitgen -g Binary:Yes -w top.ncd top.bit
+    <BLANKLINE>
+    """
+    options = dict(metadata["toolchain_options"])
+    options.update(overrides or {})
+    build_name = metadata["build_name"]
+
+    template = TOOLCHAIN_SCRIPTS.get(metadata["toolchain"], None)
+    if template is not None:
+        return template.format(build_name=build_name, **options)
+
+    script = "build_{}.sh".format(build_name)
+    assert script in metadata["files"], (
+        "Don't know how to run {} from a checkpoint.".format(metadata["toolchain"]))
+    return "set -e\nbash {}\n".format(script)
+
+
+def add_switch(script, cmdname, argument):
+    """
+    Insert a switch after each invocation of cmdname in a script, like
+    targets.utils.platform_toolchain_extend does for build templates.
+
+    >>> print(add_switch("set -e\\npar -w top_map.ncd top.ncd\\n", "par", "-t 4"))
+    set -e
+    par -t 4 -w top_map.ncd top.ncd
+    <BLANKLINE>
+    >>> print(add_switch("place_design\\nroute_design", "place_design", "-directive Explore"))
+    place_design -directive Explore
+    route_design
+    """
+    assert argument.startswith('-'), argument
+    lines = []
+    for line in script.split("\n"):
+        parts = line.split(" ")
+        if parts[0] == cmdname:
+            parts.insert(1, argument)
+        lines.append(" ".join(parts))
+    return "\n".join(lines)
+
+
+def prepare(checkpoint_dir, output_dir, overrides=None, switches=None):
+    """
+    Copy the checkpoint into output_dir and write the toolchain script.
+
+    switches is a list of (cmdname, argument) which are added to the
+    toolchain script and any scripts (.sh, .tcl) in the checkpoint.
+    """
+    metadata = read(checkpoint_dir)
+
+    os.makedirs(output_dir, exist_ok=True)
+    for fn in metadata["files"]:
+        if os.path.splitext(fn)[-1] not in (".sh", ".tcl"):
+            shutil.copy2(os.path.join(checkpoint_dir, fn), os.path.join(output_dir, fn))
+            continue
+        with open(os.path.join(checkpoint_dir, fn)) as f:
+            data = f.read()
+        for cmdname, argument in switches or []:
+            data = add_switch(data, cmdname, argument)
+        with open(os.path.join(output_dir, fn), "w") as f:
+            f.write(data)
+
+    script = get_script(metadata, overrides)
+    for cmdname, argument in switches or []:
+        script = add_switch(script, cmdname, argument)
+    with open(os.path.join(output_dir, CHECKPOINT_SCRIPT), "w") as f:
+        f.write(script)
+
+    return metadata
+
+
+def run_toolchain(platform, gateware_dir, build_name="top"):
+    """
+    Run the toolchain on the files a build with run=False wrote into
+    gateware_dir, returns the toolchain exit code.
+    """
+    metadata = {
+        "toolchain": platform.toolchain.__class__.__name__,
+        "build_name": build_name,
+        "toolchain_options": _get_toolchain_options(platform),
+        "files": sorted(os.listdir(gateware_dir)),
+    }
+    with open(os.path.join(gateware_dir, CHECKPOINT_SCRIPT), "w") as f:
+        f.write(get_script(metadata))
+    return subprocess.call(["bash", CHECKPOINT_SCRIPT], cwd=gateware_dir)
+
+
+def run(checkpoint_dir, output_dir, overrides=None, switches=None, stdout=None):
+    """Run only the toolchain stage, returns the toolchain exit code."""
+    prepare(checkpoint_dir, output_dir, overrides, switches)
+    return subprocess.call(
+        ["bash", CHECKPOINT_SCRIPT], cwd=output_dir,
+        stdout=stdout, stderr=subprocess.STDOUT if stdout else None)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -153,6 +153,7 @@ static void help_encoder(void)
 	wputs("  encoder off                    - disable encoder");
 	wputs("  encoder quality <quality>      - select quality");
 	wputs("  encoder fps <fps>              - configure target fps");
+	wputs("  encoder bitrate <kbps>         - rate control to kbps (0 = off)");
 }
 #endif
 
@@ -979,6 +980,12 @@ void encoder_configure_quality(int quality)
 	encoder_set_quality(quality);
 }
 
+void encoder_configure_bitrate(int kbps)
+{
+	wprintf("Setting encoder bitrate to %d kbps\n", kbps);
+	encoder_set_bitrate(kbps);
+}
+
 void encoder_configure_fps(int fps)
 {
 	wprintf("Setting encoder fps to %d\n", fps);
@@ -1219,6 +1226,8 @@ void ci_service(void)
 			encoder_configure_quality(atoi(get_token(&str)));
 		else if(strcmp(token, "fps") == 0)
 			encoder_configure_fps(atoi(get_token(&str)));
+		else if(strcmp(token, "bitrate") == 0)
+			encoder_configure_bitrate(atoi(get_token(&str)));
 		else
 			help_encoder();
 	}
@@ -28,6 +28,7 @@ void input1_off(void);
 void encoder_on(void);
 void encoder_configure_quality(int quality);
 void encoder_configure_fps(int fps);
+void encoder_configure_bitrate(int kbps);
 void encoder_off(void);
 #endif
 
@@ -115,19 +115,15 @@ void encoder_init(int quality) {
 	if(quality == 100) {
 		encoder_config_table(ENCODER_QUANTIZER_RAM_LUMA_BASE, luma_rom_100);
 		encoder_config_table(ENCODER_QUANTIZER_RAM_CHROMA_BASE, chroma_rom_100);
-		encoder_quality = 100;
 	} else if (quality == 85) {
 		encoder_config_table(ENCODER_QUANTIZER_RAM_LUMA_BASE, luma_rom_85);
 		encoder_config_table(ENCODER_QUANTIZER_RAM_CHROMA_BASE, chroma_rom_85);
-		encoder_quality = 85;
 	} else if (quality == 75) {
 		encoder_config_table(ENCODER_QUANTIZER_RAM_LUMA_BASE, luma_rom_75);
 		encoder_config_table(ENCODER_QUANTIZER_RAM_CHROMA_BASE, chroma_rom_75);
-		encoder_quality = 75;
 	} else {
 		encoder_config_table(ENCODER_QUANTIZER_RAM_LUMA_BASE, luma_rom_50);
 		encoder_config_table(ENCODER_QUANTIZER_RAM_CHROMA_BASE, chroma_rom_50);
-		encoder_quality = 50;
 	}
 }
 
@@ -159,6 +155,20 @@ int encoder_set_quality(int quality) {
 	return 1;
 }
 
+int encoder_set_bitrate(int kbps) {
+#ifdef CSR_ENCODER_RATE_BASE
+	if(kbps < 0 || kbps > 1000000) {
+		wprintf("Unsupported encoder bitrate\n");
+		return 0;
+	}
+	encoder_rate_target_bitrate_write(kbps*1000);
+	return 1;
+#else
+	wprintf("No encoder rate control in this gateware\n");
+	return 0;
+#endif
+}
+
 int encoder_set_fps(int fps) {
 	if(encoder_target_fps > 0 && encoder_target_fps <= 60) {
 		encoder_target_fps = fps;
@@ -176,12 +186,20 @@ void encoder_service(void) {
 	static int last_fps_event;
 	static int frame_cnt;
 	static int can_start;
+	int quality;
 
 	if(encoder_enabled) {
 		if(elapsed(&last_event, CONFIG_CLOCK_FREQUENCY/encoder_target_fps))
 			can_start = 1;
 		if(can_start & encoder_done()) {
-			encoder_init(encoder_quality);
+			quality = encoder_quality;
+#ifdef CSR_ENCODER_RATE_BASE
+			/* Quality picked by the gateware from the last frame sizes,
+			 * encoder_quality is kept for when rate control is off */
+			if(encoder_rate_target_bitrate_read())
+				quality = encoder_rate_quality_read();
+#endif
+			encoder_init(quality);
 			encoder_start(processor_h_active, processor_v_active);
 			can_start = 0;
 			frame_cnt++;
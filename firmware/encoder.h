@@ -34,6 +34,7 @@ void encoder_start(short resx, short resy);
 int encoder_done(void);
 void encoder_enable(char enable);
 int encoder_set_quality(int quality);
+int encoder_set_bitrate(int kbps);
 int encoder_set_fps(int fps);
 void encoder_service(void);
 
@@ -39,6 +39,8 @@
  *  0x0.040000 - HDMI Input x - Frame Buffer n+1
  *  0x0.080000 - HDMI Input x - Frame Buffer n+2
  *
+ *  Top of main RAM - Multi core encoder stripe FIFOs (gateware/encoder/multi.py)
+ *
  */
 #define FRAMEBUFFER_OFFSET		0x01000000
 #define FRAMEBUFFER_PATTERNS		1
@@ -12,8 +12,26 @@
 #include "uptime.h"
 #include "version_data.h"
 
+#ifdef MAIN_RAM_BASE
+// Last 4 bytes of the pattern buffer area, written by the host (see
+// test/load_pattern.py --live) to flip between the pattern frame buffers.
+volatile unsigned int * pattern_fb_index = (unsigned int*)(MAIN_RAM_BASE + FRAMEBUFFER_BASE_PATTERN + FRAMEBUFFER_COUNT * FRAMEBUFFER_SIZE - sizeof(unsigned int));
+#endif
+
+static unsigned int pattern_fb_current;
+
+/* Called once per main loop pass, and only while a pattern source is shown */
+void pattern_fb_index_update(void) {
+#ifdef MAIN_RAM_BASE
+	/* The index is written to DRAM by the host over Etherbone. That goes
+	 * through the L2 like the CPU, so only the L1 copy can be stale. */
+	flush_cpu_dcache();
+	pattern_fb_current = (*pattern_fb_index) & FRAMEBUFFER_MASK;
+#endif
+}
+
 unsigned int pattern_framebuffer_base(void) {
-	return FRAMEBUFFER_BASE_PATTERN;
+	return FRAMEBUFFER_BASE_PATTERN + pattern_fb_current * FRAMEBUFFER_SIZE;
 }
 
 #ifdef MAIN_RAM_BASE
@@ -174,6 +192,8 @@ void pattern_fill_framebuffer(int h_active, int w_active)
 #ifdef MAIN_RAM_BASE
 	int i, j;
 	int color;
+	*pattern_fb_index = 0;
+	pattern_fb_current = 0;
 	flush_l2_cache();
 	color = -1;
 	volatile unsigned int *framebuffer = (unsigned int *)(MAIN_RAM_BASE + pattern_framebuffer_base());
@@ -23,6 +23,8 @@
 #define RGB_BLUE   0x00ff0000
 #define RGB_BLACK  0x00000000
 
+extern volatile unsigned int * pattern_fb_index;
+void pattern_fb_index_update(void);
 unsigned int pattern_framebuffer_base(void);
 
 enum {
@@ -720,6 +720,12 @@ void processor_update(void)
 #ifdef CSR_PCIE_PHY_BASE
 	unsigned int pcie_in_fb_idx = (*pcie_in_fb_index) >> 24;
 #endif
+	/* Only pick up host pattern buffer flips while the pattern is in use */
+	if(processor_hdmi_out0_source == VIDEO_IN_PATTERN ||
+	   processor_hdmi_out1_source == VIDEO_IN_PATTERN ||
+	   processor_encoder_source == VIDEO_IN_PATTERN)
+		pattern_fb_index_update();
+
 #ifdef CSR_HDMI_OUT0_BASE
 	/*  hdmi_out0 */
 #ifdef CSR_HDMI_IN0_BASE
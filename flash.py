@@ -1,40 +1,260 @@
 #!/usr/bin/env python3
 
+import startup_profile
+
 import os
 import argparse
+import hashlib
+import json
+import struct
+import sys
+import tempfile
 
 import make
+import mkimage
+
+
+def get_sectors(data, address_start, sector_size, head=b""):
+    """
+    Split data (to be flashed at address_start) into whole sectors, padding
+    the last one with 0xff like the erase would. When address_start isn't
+    sector aligned, head is what the flash holds between the start of the
+    sector and address_start.
+
+    >>> [(hex(a), d) for a, d in get_sectors(b"abcde", 0x10, 4)]
+    [('0x10', b'abcd'), ('0x14', b'e\\xff\\xff\\xff')]
+    >>> [(hex(a), d) for a, d in get_sectors(b"cdef", 0x12, 4, head=b"ab")]
+    [('0x10', b'abcd'), ('0x14', b'ef\\xff\\xff')]
+    """
+    offset = address_start % sector_size
+    assert len(head) == offset, (
+        "0x{:x} is not sector aligned, need the {} bytes before it".format(address_start, offset))
+    data = head + data
+    address_start -= offset
+    sectors = []
+    for i in range(0, len(data), sector_size):
+        sector = data[i:i+sector_size]
+        sector += b"\xff" * (sector_size - len(sector))
+        sectors.append((address_start + i, sector))
+    return sectors
+
+
+def get_dirty_runs(state, sectors):
+    """
+    Coalesce the sectors which differ from the recorded state into
+    contiguous (address, data) runs.
+
+    >>> sectors = [(0, b"aa"), (2, b"bb"), (4, b"cc"), (6, b"dd")]
+    >>> state = {"0x000000": sector_hash(b"aa"), "0x000004": sector_hash(b"cc")}
+    >>> get_dirty_runs(state, sectors)
+    [(2, b'bb'), (6, b'dd')]
+    >>> get_dirty_runs({}, sectors)
+    [(0, b'aabbccdd')]
+    """
+    runs = []
+    for address, data in sectors:
+        if state.get(sector_key(address)) == sector_hash(data):
+            continue
+        if runs and runs[-1][0] + len(runs[-1][1]) == address:
+            runs[-1] = (runs[-1][0], runs[-1][1] + data)
+        else:
+            runs.append((address, data))
+    return runs
+
+
+def sector_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def sector_key(address):
+    return "0x{:06x}".format(address)
+
+
+def get_state_dir(platform):
+    return os.path.join("build", "flash-state", platform)
+
+
+def get_state_file(platform, board):
+    return os.path.join(get_state_dir(platform), "{}.json".format(board))
+
+
+def read_state(filename, sector_size):
+    """
+    What was last flashed onto a board; the hash of each sector, and a copy
+    of the sectors only partly written by a flash which didn't start on a
+    sector boundary (so the next one can rebuild them).
+    """
+    state = {"sectors": {}, "partial": {}}
+    if not os.path.exists(filename):
+        return state
+    with open(filename) as f:
+        saved = json.load(f)
+    if saved.get("sector_size") != sector_size:
+        return state
+    state["sectors"] = saved["sectors"]
+    state["partial"] = saved.get("partial", {})
+    return state
+
+
+def write_state(filename, sector_size, state):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, "w") as f:
+        json.dump({"sector_size": sector_size, **state}, f, indent=1, sort_keys=True)
+
+
+def invalidate_state(filename, sector_size, address_start, length):
+    """Forget the sectors a flash (of unknown effect on them) touched."""
+    state = read_state(filename, sector_size)
+    first = address_start - address_start % sector_size
+    for address in range(first, address_start + length, sector_size):
+        state["sectors"].pop(sector_key(address), None)
+        state["partial"].pop(sector_key(address), None)
+    write_state(filename, sector_size, state)
+
+
+def get_head(args, state, sector_size, address_start):
+    """
+    The flash contents from the start of the sector holding address_start
+    up to it; from the copy kept in the state, the built image when the
+    recorded hash shows that is what the board holds, or reading the flash
+    through litex_server.
+    """
+    offset = address_start % sector_size
+    address = address_start - offset
+    key = sector_key(address)
+    recorded = state["sectors"].get(key)
+
+    partial = state["partial"].get(key)
+    if recorded and partial:
+        sector = bytes.fromhex(partial)
+        if sector_hash(sector) == recorded:
+            return sector[:offset]
+
+    image = make.get_image(make.get_builddir(args), "flash")
+    if recorded and os.path.exists(image):
+        with open(image, "rb") as f:
+            f.seek(address)
+            sector = f.read(sector_size)
+        sector += b"\xff" * (sector_size - len(sector))
+        if sector_hash(sector) == recorded:
+            return sector[:offset]
+
+    try:
+        from litex.tools.litex_client import RemoteClient
+        wb = RemoteClient(args.bind_ip, int(args.bind_port),
+            csr_csv=os.path.join(make.get_testdir(args), "csr.csv"))
+        wb.open()
+    except (OSError, ImportError) as e:
+        raise SystemExit(
+            "Don't know what the flash holds at 0x{:x}-0x{:x} ({}).\n"
+            "Run litex_server so it can be read, or flash the image with --delta first.".format(
+                address, address_start, e))
+    head = read_flash(wb, address, offset)
+    wb.close()
+    return head
+
+
+def flash_delta(args, prog, state_file, sector_size, address_start, data):
+    """Only erase and program the sectors which changed since the last flash."""
+    state = read_state(state_file, sector_size)
+    head = b""
+    if address_start % sector_size:
+        head = get_head(args, state, sector_size, address_start)
+    sectors = get_sectors(data, address_start, sector_size, head)
+    runs = get_dirty_runs(state["sectors"], sectors)
+
+    dirty = sum(len(d) for _, d in runs) // sector_size
+    print("Delta flashing {} of {} sectors in {} runs".format(dirty, len(sectors), len(runs)))
+
+    for address, run_data in runs:
+        with tempfile.NamedTemporaryFile(suffix=".bin") as f:
+            f.write(run_data)
+            f.flush()
+            prog.flash(address, f.name)
+        # Record the progress after every run, so an interrupted flash only
+        # redoes what is left.
+        for i in range(0, len(run_data), sector_size):
+            key = sector_key(address + i)
+            sector = run_data[i:i+sector_size]
+            state["sectors"][key] = sector_hash(sector)
+            if head and address + i == sectors[0][0]:
+                state["partial"][key] = sector.hex()
+            else:
+                state["partial"].pop(key, None)
+        write_state(state_file, sector_size, state)
+
+
+def read_flash(wb, address, length):
+    """Read length bytes of the SPI flash (memory mapped on the bus)."""
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "test"))
+    from common import bulk_read_words
+    words = bulk_read_words(wb, wb.mems.spiflash.base + address, (length + 3) // 4)
+    return struct.pack(">{}I".format(len(words)), *words)[:length]
+
+
+def verify(args, wb, manifest):
+    """Compare the hash of each region in the manifest with the board's flash."""
+    ok = True
+    for region in manifest["regions"]:
+        if not region["size"]:
+            continue
+        data = read_flash(wb, region["offset"], region["size"])
+        match = sector_hash(data) == region["sha256"]
+        ok = ok and match
+        print("{:>8s} @ 0x{:08x} ({:10} bytes) {}".format(
+            region["name"], region["offset"], region["size"],
+            "OK" if match else "MISMATCH (expected {})".format(region["source"])))
+    return ok
 
 
 def main():
+    startup_profile.imports_done()
     parser = argparse.ArgumentParser(description="Board flashing tool")
     make.get_args(parser)
 
     parser.add_argument("--mode", default="image", choices=["image", "gateware", "bios", "firmware", "other"], help="Type of file to flash")
     parser.add_argument("--other-file", default=None)
     parser.add_argument("--address", type=int, help="Where to flash if using --mode=other")
+    parser.add_argument("--delta", action="store_true", help="Only erase / program the sectors which changed since the last --delta flash")
+    parser.add_argument("--board", default=None, help="Name of the board (eg its DNA), used to track what was last flashed, needed with --delta")
+    parser.add_argument("--delta-reset", action="store_true", help="Forget what was flashed onto the board (ie the board was flashed some other way)")
+    parser.add_argument("--verify", action="store_true", help="Don't flash, compare the regions in the image manifest with the board (needs litex_server)")
+    parser.add_argument("--bind-ip", default="localhost", help="litex_server address for --verify (and --delta reading the flash)")
+    parser.add_argument("--bind-port", default=1234, help="litex_server port for --verify (and --delta reading the flash)")
 
     args = parser.parse_args()
 
     builddir = make.get_builddir(args)
-    platform = make.get_platform(args)
-    soc = make.get_soc(args, platform)
-    bios_maxsize = make.get_bios_maxsize(args, soc)
+
+    if args.verify:
+        from litex.tools.litex_client import RemoteClient
+        manifest = mkimage.read_manifest(make.get_image(builddir, "flash"))
+        wb = RemoteClient(args.bind_ip, int(args.bind_port),
+            csr_csv=os.path.join(make.get_testdir(args), "csr.csv"))
+        wb.open()
+        ok = verify(args, wb, manifest)
+        wb.close()
+        exit(0 if ok else 1)
+
+    layout = make.get_flash_layout(args)
+    gateware_size = layout["gateware_size"]
+    spiflash_total_size = layout["spiflash_total_size"]
+    bios_maxsize = layout["bios_maxsize"]
 
     if args.mode == 'image':
         filename = make.get_image(builddir, "flash")
         address_start = 0
-        address_end = platform.spiflash_total_size
+        address_end = spiflash_total_size
 
     elif args.mode == 'gateware':
         filename = make.get_gateware(builddir, "flash")
         address_start = 0
-        address_end = platform.gateware_size
+        address_end = gateware_size
 
     elif args.mode == 'bios':
         filename = make.get_bios(builddir, "flash")
-        address_start = platform.gateware_size
-        address_end = platform.gateware_size + bios_maxsize
+        address_start = gateware_size
+        address_end = gateware_size + bios_maxsize
 
     elif args.mode == 'firmware':
         if args.override_firmware:
@@ -42,13 +262,13 @@ def main():
         else:
             filename = make.get_firmware(builddir, "flash")
 
-        address_start = platform.gateware_size + bios_maxsize
-        address_end = platform.spiflash_total_size
+        address_start = gateware_size + bios_maxsize
+        address_end = spiflash_total_size
 
     elif args.mode == 'other':
         filename = args.other_file
         address_start = args.address
-        address_end = platform.spiflash_total_size
+        address_end = spiflash_total_size
 
     else:
         assert False, "Unknown flashing mode."
@@ -59,15 +279,43 @@ def main():
     assert os.path.exists(filepath), "%s not found at %s" % (
             args.mode, filepath)
 
-    file_size = len(open(filepath, 'rb').read())
+    with startup_profile.phase("read"):
+        data = open(filepath, 'rb').read()
+        file_size = len(data)
 
     file_end = address_start+file_size
     assert file_end < address_end, "File is too big!\n%s file doesn't fit in %s space (%s extra bytes)." % (
         filename, file_size, address_end - address_start)
 
-    prog = make.get_prog(args, platform)
-    prog.flash(address_start, filepath)
+    with startup_profile.phase("programmer"):
+        prog = make.get_prog(args, make.get_platform(args))
+    startup_profile.report(args, "flash.py")
+
+    sector_size = layout["spiflash_sector_size"]
+    if args.board:
+        state_files = [get_state_file(args.platform, args.board)]
+    else:
+        # Without --board we don't know which board this is, so anything
+        # recorded for a board of this platform may now be wrong.
+        state_dir = get_state_dir(args.platform)
+        state_files = [os.path.join(state_dir, f) for f in sorted(os.listdir(state_dir))
+                       if f.endswith(".json")] if os.path.isdir(state_dir) else []
 
+    if args.delta_reset:
+        assert args.board, "--delta-reset needs --board."
+        if os.path.exists(state_files[0]):
+            os.unlink(state_files[0])
+
+    if args.delta:
+        assert sector_size, "Platform doesn't define spiflash_sector_size."
+        assert args.board, "--delta needs --board, to track what is on each board."
+        flash_delta(args, prog, state_files[0], sector_size, address_start, data)
+    else:
+        prog.flash(address_start, filepath)
+        # Keep the records up to date, so a later --delta flash is correct.
+        if sector_size:
+            for state_file in state_files:
+                invalidate_state(state_file, sector_size, address_start, file_size)
 
 if __name__ == "__main__":
     main()
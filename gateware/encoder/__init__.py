@@ -1 +1,4 @@
-from gateware.encoder.core import EncoderDMAReader, EncoderBuffer, Encoder
+from gateware.encoder.core import EncoderDMAReader, EncoderPrefetchReader, EncoderBuffer, EncoderMultiBuffer, Encoder
+from gateware.encoder.multi import MultiEncoderDMAReader, MultiEncoder, stripe_buffer_base
+from gateware.encoder.stats import EncoderStats
+from gateware.encoder.ratecontrol import EncoderRateControl
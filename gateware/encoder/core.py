@@ -1,7 +1,7 @@
 import os
 
 from migen import *
-from migen.genlib.cdc import MultiReg
+from migen.genlib.cdc import MultiReg, PulseSynchronizer
 from migen.genlib.misc import chooser
 
 from litex.soc.interconnect import wishbone
@@ -115,6 +115,169 @@ class EncoderDMAReader(Module, AutoCSR):
         ]
 
 
+class EncoderPrefetchReader(Module, AutoCSR):
+    """
+    Drop in replacement for EncoderDMAReader.
+
+    Whole strips of 8 lines are read in line order (so consecutive requests
+    stay in the same DRAM row) into a line buffer, and then output in the
+    MCU order the encoder wants. One strip is fetched while the previous
+    one is output, with up to `inflight` reads outstanding.
+    """
+    def __init__(self, dram_port, inflight=8, max_h_width=1920):
+        self.source = source = stream.Endpoint([("data", 128)])
+        self.base = CSRStorage(32)
+        self.h_width = CSRStorage(16)
+        self.v_width = CSRStorage(16)
+        self.start = CSR()
+        self.done = CSRStatus()
+
+        # # #
+
+        self.submodules.dma = dma = LiteDRAMDMAReader(dram_port, fifo_depth=inflight)
+
+        pixel_bits = 16 # ycbcr 4:2:2
+        burst_pixels = dram_port.dw//pixel_bits
+        alignment_bits = bits_for(dram_port.dw//8) - 1
+        assert burst_pixels == 8, "MCU ordering needs 8 pixels per burst"
+        max_words = max_h_width//burst_pixels
+        slots = 2
+
+        base = Signal(32)
+        h_width = Signal(16)
+        words = Signal(16)  # bursts per line
+        strips = Signal(16) # strips of 8 lines per frame
+        start = self.start.r & self.start.re
+        self.sync += If(start,
+            base.eq(self.base.storage),
+            h_width.eq(self.h_width.storage),
+            words.eq(self.h_width.storage[log2_int(burst_pixels):]),
+            strips.eq(self.v_width.storage[3:])
+        )
+
+        # line buffer, 8 lines per slot
+        mem = Memory(dram_port.dw, slots*8*max_words)
+        write_port = mem.get_port(write_capable=True)
+        # synchronous read (with enable, dat_r holds the last word read) so
+        # it maps to block RAM
+        read_port = mem.get_port(has_re=True)
+        self.specials += mem, write_port, read_port
+
+        # strips requested / written to the line buffer / output
+        requested = Signal(16)
+        written = Signal(16)
+        emitted = Signal(16)
+
+        running = Signal()
+        out_valid = Signal()
+        self.sync += \
+            If(start,
+                running.eq(1)
+            ).Elif((emitted == strips) & ~out_valid,
+                running.eq(0)
+            )
+        self.comb += self.done.status.eq(~running)
+
+        # requests, in line order
+        req_w = Signal(16)
+        req_v = Signal(3)
+        req_step = Signal()
+        self.comb += [
+            dma.sink.valid.eq(running & (requested != strips) &
+                              ((requested - emitted) < slots)),
+            req_step.eq(dma.sink.valid & dma.sink.ready)
+        ]
+        self.sync += \
+            If(start,
+                req_w.eq(0),
+                req_v.eq(0),
+                requested.eq(0)
+            ).Elif(req_step,
+                If(req_w == words - 1,
+                    req_w.eq(0),
+                    req_v.eq(req_v + 1),
+                    If(req_v == 7,
+                        requested.eq(requested + 1)
+                    )
+                ).Else(
+                    req_w.eq(req_w + 1)
+                )
+            )
+
+        read_address = Signal(dram_port.aw + alignment_bits)
+        self.comb += [
+            read_address.eq(Cat(req_v, requested) * h_width + req_w * burst_pixels),
+            dma.sink.address.eq(
+                base[alignment_bits:] +
+                read_address[alignment_bits - log2_int(pixel_bits//8):])
+        ]
+
+        # data returned (in request order) to the line buffer
+        wr_w = Signal(16)
+        wr_v = Signal(3)
+        wr_step = Signal()
+        self.comb += [
+            dma.source.ready.eq(1),
+            wr_step.eq(dma.source.valid),
+            write_port.adr.eq(written[0]*8*max_words + wr_v*max_words + wr_w),
+            write_port.dat_w.eq(dma.source.data),
+            write_port.we.eq(wr_step)
+        ]
+        self.sync += \
+            If(start,
+                wr_w.eq(0),
+                wr_v.eq(0),
+                written.eq(0)
+            ).Elif(wr_step,
+                If(wr_w == words - 1,
+                    wr_w.eq(0),
+                    wr_v.eq(wr_v + 1),
+                    If(wr_v == 7,
+                        written.eq(written + 1)
+                    )
+                ).Else(
+                    wr_w.eq(wr_w + 1)
+                )
+            )
+
+        # output, in MCU order. A word is read from the line buffer when
+        # the output register (dat_r) is empty or being taken.
+        rd_w = Signal(16)
+        rd_v = Signal(3)
+        rd_step = Signal()
+        self.comb += [
+            rd_step.eq(running & (written != emitted) & (~out_valid | source.ready)),
+            read_port.adr.eq(emitted[0]*8*max_words + rd_v*max_words + rd_w),
+            read_port.re.eq(rd_step),
+            source.valid.eq(out_valid),
+            source.data.eq(read_port.dat_r)
+        ]
+        self.sync += \
+            If(start,
+                out_valid.eq(0)
+            ).Elif(rd_step,
+                out_valid.eq(1)
+            ).Elif(source.ready,
+                out_valid.eq(0)
+            )
+        self.sync += \
+            If(start,
+                rd_w.eq(0),
+                rd_v.eq(0),
+                emitted.eq(0)
+            ).Elif(rd_step,
+                rd_v.eq(rd_v + 1),
+                If(rd_v == 7,
+                    If(rd_w == words - 1,
+                        rd_w.eq(0),
+                        emitted.eq(emitted + 1)
+                    ).Else(
+                        rd_w.eq(rd_w + 1)
+                    )
+                )
+            )
+
+
 class EncoderBuffer(Module):
     def __init__(self):
         self.sink = sink = stream.Endpoint([("data", 128)])
@@ -232,6 +395,121 @@ class EncoderBuffer(Module):
         )
 
 
+class _EncoderMultiBufferCore(Module):
+    def __init__(self, nslots):
+        self.sink = sink = stream.Endpoint([("data", 128)])
+        self.source = source = stream.Endpoint([("data", 16)])
+        slot_bits = log2_int(nslots)
+        self.level = level = Signal(slot_bits + 1)
+        self.high_water = high_water = Signal(slot_bits + 1)
+        self.high_water_clear = Signal()
+        # level / high_water copied on update, so they can be read from
+        # another clock domain while they don't change
+        self.update = Signal()
+        self.level_snapshot = Signal(slot_bits + 1)
+        self.high_water_snapshot = Signal(slot_bits + 1)
+
+        # # #
+
+        # mem, nslots of 8 words (one MCU column of 8 lines of 8 pixels)
+        mem = Memory(128, 8*nslots)
+        write_port = mem.get_port(write_capable=True)
+        read_port = mem.get_port(async_read=True)
+        self.specials += mem, write_port, read_port
+
+        # slot pointers, with an extra bit to tell full from empty
+        write_slot = Signal(slot_bits + 1)
+        read_slot = Signal(slot_bits + 1)
+        self.comb += level.eq(write_slot - read_slot)
+        self.sync += \
+            If(self.high_water_clear,
+                high_water.eq(0)
+            ).Elif(level > high_water,
+                high_water.eq(level)
+            )
+        self.sync += \
+            If(self.update,
+                self.level_snapshot.eq(level),
+                self.high_water_snapshot.eq(high_water)
+            )
+
+        # write path
+        v_write = Signal(3)
+        self.comb += [
+            sink.ready.eq(level != nslots),
+            write_port.adr.eq(Cat(v_write, write_slot[:slot_bits])),
+            write_port.dat_w.eq(sink.data),
+            write_port.we.eq(sink.valid & sink.ready)
+        ]
+        self.sync += \
+            If(sink.valid & sink.ready,
+                v_write.eq(v_write + 1),
+                If(v_write == 7,
+                    write_slot.eq(write_slot + 1)
+                )
+            )
+
+        # read path
+        h_read = Signal(3)
+        v_read = Signal(3)
+        self.comb += [
+            source.valid.eq(level != 0),
+            source.last.eq((h_read == 7) & (v_read == 7)),
+            read_port.adr.eq(Cat(v_read, read_slot[:slot_bits])),
+            chooser(read_port.dat_r, h_read, source.data, reverse=True)
+        ]
+        self.sync += \
+            If(source.valid & source.ready,
+                h_read.eq(h_read + 1),
+                If(h_read == 7,
+                    v_read.eq(v_read + 1),
+                    If(v_read == 7,
+                        read_slot.eq(read_slot + 1)
+                    )
+                )
+            )
+
+
+class EncoderMultiBuffer(Module, AutoCSR):
+    """
+    EncoderBuffer with nslots (a power of 2) MCU columns instead of two, so
+    DRAM latency spikes are absorbed rather than stalling the encoder. Use
+    h_width/8 slots to buffer a full MCU row.
+
+    The buffer runs in clock domain cd. level is the number of full slots
+    and high_water the highest level since high_water_clear was written,
+    to size the buffer for each board. Both are sampled when update is
+    written.
+    """
+    def __init__(self, nslots=16, cd="encoder"):
+        self.submodules.core = core = ClockDomainsRenamer(cd)(_EncoderMultiBufferCore(nslots))
+        self.sink = core.sink
+        self.source = core.source
+
+        self.level = CSRStatus(len(core.level))
+        self.high_water = CSRStatus(len(core.high_water))
+        self.high_water_clear = CSR()
+        self.update = CSR()
+
+        # # #
+
+        # The snapshots only change on update, so they are stable by the
+        # time they are read.
+        self.specials += [
+            MultiReg(core.level_snapshot, self.level.status),
+            MultiReg(core.high_water_snapshot, self.high_water.status)
+        ]
+        clear = PulseSynchronizer("sys", cd)
+        update = PulseSynchronizer("sys", cd)
+        self.submodules += clear, update
+        self.comb += [
+            clear.i.eq(self.high_water_clear.re),
+            core.high_water_clear.eq(clear.o),
+            update.i.eq(self.update.re),
+            core.update.eq(update.o)
+        ]
+
+
 class Encoder(Module, AutoCSR):
     def __init__(self, platform):
         self.sink = stream.Endpoint([("data", 16)])
@@ -251,7 +529,7 @@ class Encoder(Module, AutoCSR):
 
         fdct_fifo_rd = Signal()
         fdct_fifo_q = Signal(24)
-        fdct_fifo_hf_full = Signal()
+        self.fdct_fifo_hf_full = fdct_fifo_hf_full = Signal()
 
         fdct_data_d1 = Signal(24)
         fdct_data_d2 = Signal(24)
@@ -277,7 +555,7 @@ class Encoder(Module, AutoCSR):
         ]
 
         # output fifo
-        output_fifo_almost_full = Signal()
+        self.output_fifo_almost_full = output_fifo_almost_full = Signal()
         output_fifo = stream.SyncFIFO([("data", 8)], 1024, buffered=True)
         output_fifo = ClockDomainsRenamer("encoder")(output_fifo)
         self.submodules += output_fifo
@@ -0,0 +1,533 @@
+"""
+Multiple JpegEnc cores encoding horizontal stripes of the same frame.
+
+Each frame is split into ncores stripes (a multiple of 8 lines, the last
+stripe gets what is left). Every stripe is read, buffered and encoded by
+its own pipeline, and the outputs are merged into a single JFIF stream
+with a restart interval of one stripe, so a decoder sees a normal JPEG
+with RSTn markers between the stripes.
+
+The merger takes the stripes in order, so the output of every core but
+the first goes through a DRAM FIFO of stripe_size bytes (from base, at
+the top of main RAM above the frame buffers); all the cores encode at
+the same time rather than waiting on their 1KB output FIFO.
+
+The CSRs and the Wishbone bus look the same as a single EncoderDMAReader /
+Encoder, so the firmware doesn't need to know how many cores there are.
+In a target, in place of the reader / cdc / buffer / Encoder;
+
+    ports = [self.sdram.crossbar.get_port() for i in range(2)]
+    self.submodules.encoder_reader = MultiEncoderDMAReader(ports)
+    self.add_csr("encoder_reader")
+    buffer_ports = [(self.sdram.crossbar.get_port(), self.sdram.crossbar.get_port())]
+    base = stripe_buffer_base(sdram_module, self.ddrphy.settings.databits, 2)
+    self.submodules.encoder = encoder = MultiEncoder(platform,
+        self.encoder_reader.sources, buffer_ports, base)
+    self.comb += encoder.source.connect(encoder_streamer.sink)
+    self.add_wb_slave(self.mem_map["encoder"], encoder.bus)
+
+Each core is a full JpegEnc (with its own block RAMs), so this is meant
+for the larger Artix-7 parts rather than the Spartan-6 boards.
+"""
+
+import random
+from functools import reduce
+from operator import and_, or_
+
+from migen import *
+from migen.genlib.cdc import MultiReg
+
+from litex.soc.interconnect import stream
+from litex.soc.interconnect import wishbone
+from litex.soc.interconnect.csr import *
+
+from litedram.frontend.dma import LiteDRAMDMAReader, LiteDRAMDMAWriter
+
+from gateware.encoder.core import EncoderPrefetchReader, EncoderMultiBuffer, Encoder
+
+
+# C_HDR_SIZE in vhdl/JPEG_PKG.vhd, the header is output before the data.
+HEADER_SIZE = 623
+# Offset of the SOF0 segment in the header, after SOI and APP0; the DRI
+# segment is inserted there.
+HEADER_SOF = 20
+# Offset of the image height in the header (C_SIZE_Y_H in vhdl/JFIFGen.vhd)
+HEADER_SIZE_Y = 25
+# ENCODER_IMAGE_SIZE_REG in firmware/encoder.h (word address)
+IMAGE_SIZE_REG = 0x4 >> 2
+
+# Size of each stripe FIFO, at the top of main RAM (see stripe_buffer_base).
+STRIPE_BUFFER_SIZE = 0x00100000
+
+
+def stripe_buffer_base(sdram_module, databits, ncores,
+                       stripe_size=STRIPE_BUFFER_SIZE):
+    """
+    Main RAM offset of the ncores - 1 stripe FIFOs, at the top of the DRAM
+    of sdram_module and a PHY with databits bits, above the frame buffers
+    (firmware/framebuffer.h).
+
+    >>> from litedram.modules import MT41K128M16
+    >>> hex(stripe_buffer_base(MT41K128M16(100e6, "1:4"), 16, 3))
+    '0xfe00000'
+    """
+    geom = sdram_module.geom_settings
+    size = 2**(geom.bankbits + geom.rowbits + geom.colbits)*databits//8
+    return size - (ncores - 1)*stripe_size
+
+
+def stripe_rows(v_width, ncores):
+    """
+    MCU rows (of 8 lines) in each stripe but the last one; v_width/8
+    divided by ncores and rounded up, as a multiplication by the
+    reciprocal so it works for any ncores, on a Signal or an int.
+
+    >>> [stripe_rows(720, n) for n in (1, 2, 3, 4)]
+    [90, 45, 30, 23]
+    >>> all(stripe_rows(8*r, n) == -(-r//n) for n in range(1, 9) for r in range(2**13))
+    True
+    """
+    shift = 14 + bits_for(ncores)
+    factor = -(-2**shift//ncores)
+    return (((v_width + 7) >> 3) + ncores - 1)*factor >> shift
+
+
+def stripe_lines(v_width, ncores):
+    """Lines in each stripe but the last one, rounded up to whole MCUs."""
+    return stripe_rows(v_width, ncores) << 3
+
+
+class MultiEncoderDMAReader(Module, AutoCSR):
+    """One reader per stripe, with the CSRs of a single EncoderDMAReader."""
+    def __init__(self, dram_ports, reader=EncoderPrefetchReader):
+        ncores = len(dram_ports)
+        self.sources = []
+        self.base = CSRStorage(32)
+        self.h_width = CSRStorage(16)
+        self.v_width = CSRStorage(16)
+        self.start = CSR()
+        self.done = CSRStatus()
+
+        # # #
+
+        lines = Signal(16)
+        stripe_bytes = Signal(32)
+        self.comb += [
+            lines.eq(stripe_lines(self.v_width.storage, ncores)),
+            stripe_bytes.eq(self.h_width.storage * lines * 2) # ycbcr 4:2:2
+        ]
+
+        done = []
+        # Not submodules by name, so the readers own CSRs are not
+        # collected, they are driven from ours.
+        for i, port in enumerate(dram_ports):
+            r = reader(port)
+            self.submodules += r
+            self.sources.append(r.source)
+            last = (i == ncores - 1)
+            self.comb += [
+                r.base.storage.eq(self.base.storage + i*stripe_bytes),
+                r.h_width.storage.eq(self.h_width.storage),
+                r.v_width.storage.eq(
+                    self.v_width.storage - i*lines if last else lines),
+                r.start.r.eq(self.start.r),
+                r.start.re.eq(self.start.re)
+            ]
+            done.append(r.done.status)
+        self.comb += self.done.status.eq(reduce(and_, done))
+
+
+class EncoderBroadcast(Module):
+    """
+    Forward a Wishbone bus to every core. Writes to the image size register
+    get each core's stripe height, reads return the OR of the cores (so the
+    busy bit of the status register is set until they are all done).
+    """
+    def __init__(self, buses):
+        ncores = len(buses)
+        self.bus = bus = wishbone.Interface()
+        self.h_width = Signal(16)
+        self.v_width = Signal(16)
+
+        # # #
+
+        size_write = Signal()
+        self.comb += size_write.eq(bus.stb & bus.cyc & bus.we & (bus.adr[:8] == IMAGE_SIZE_REG))
+        self.sync += If(size_write & bus.ack,
+            self.h_width.eq(bus.dat_w[16:]),
+            self.v_width.eq(bus.dat_w[:16])
+        )
+        lines = Signal(16)
+        self.comb += lines.eq(stripe_lines(bus.dat_w[:16], ncores))
+
+        acked = Signal(ncores)
+        dat_r = [Signal(32) for i in range(ncores)]
+        for i, b in enumerate(buses):
+            last = (i == ncores - 1)
+            v_width = Signal(16)
+            self.comb += [
+                v_width.eq(bus.dat_w[:16] - i*lines if last else lines),
+                b.adr.eq(bus.adr),
+                b.sel.eq(bus.sel),
+                b.we.eq(bus.we),
+                b.cyc.eq(bus.cyc & ~acked[i]),
+                b.stb.eq(bus.stb & ~acked[i]),
+                If(size_write,
+                    b.dat_w.eq(Cat(v_width, bus.dat_w[16:]))
+                ).Else(
+                    b.dat_w.eq(bus.dat_w)
+                )
+            ]
+            self.sync += If(b.ack, dat_r[i].eq(b.dat_r))
+
+        all_acked = Signal()
+        self.comb += [
+            all_acked.eq(acked == (2**ncores - 1)),
+            bus.ack.eq(all_acked),
+            bus.dat_r.eq(reduce(or_, dat_r))
+        ]
+        self.sync += \
+            If(all_acked,
+                acked.eq(0)
+            ).Else(
+                acked.eq(acked | Cat(*[b.ack for b in buses]))
+            )
+
+
+class JFIFMerger(Module):
+    """
+    Merge the JFIF streams of the stripes into one; the first header is
+    kept (with a DRI segment and the full height), the others are dropped,
+    and the EOI of each stripe but the last becomes an RSTn marker.
+    """
+    def __init__(self, ncores):
+        self.sinks = sinks = [stream.Endpoint([("data", 8)]) for i in range(ncores)]
+        self.source = source = stream.Endpoint([("data", 8)])
+        self.h_width = Signal(16)
+        self.v_width = Signal(16)
+
+        # # #
+
+        core = Signal(max=max(ncores, 2))
+        sink = stream.Endpoint([("data", 8)])
+        cases = {}
+        for i, s in enumerate(sinks):
+            cases[i] = s.connect(sink)
+        self.comb += Case(core, cases)
+
+        # restart interval, MCUs (16x8) in a stripe
+        restart_interval = Signal(16)
+        self.comb += restart_interval.eq(
+            self.h_width[4:] * stripe_rows(self.v_width, ncores))
+        dri = Array([0xff, 0xdd, 0x00, 0x04, restart_interval[8:], restart_interval[:8]])
+        dri_count = Signal(3)
+
+        header_count = Signal(max=HEADER_SIZE)
+        marker_count = Signal()
+        marker = Signal(8)
+        self.comb += \
+            If(core == ncores - 1,
+                marker.eq(0xd9) # EOI
+            ).Else(
+                marker.eq(0xd0 | core[:3]) # RSTn
+            )
+
+        header_data = Signal(8)
+        self.comb += \
+            If(header_count == HEADER_SIZE_Y,
+                header_data.eq(self.v_width[8:])
+            ).Elif(header_count == HEADER_SIZE_Y + 1,
+                header_data.eq(self.v_width[:8])
+            ).Else(
+                header_data.eq(sink.data)
+            )
+
+        self.submodules.fsm = fsm = FSM(reset_state="HEADER")
+        fsm.act("HEADER",
+            If(core == 0,
+                source.valid.eq(sink.valid),
+                source.data.eq(header_data),
+                sink.ready.eq(source.ready)
+            ).Else(
+                sink.ready.eq(1)
+            ),
+            If(sink.valid & sink.ready,
+                NextValue(header_count, header_count + 1),
+                If(header_count == HEADER_SIZE - 1,
+                    NextValue(header_count, 0),
+                    NextState("DATA")
+                ).Elif((core == 0) & (header_count == HEADER_SOF - 1),
+                    # after APP0, before SOF0
+                    NextState("DRI")
+                )
+            )
+        )
+        fsm.act("DRI",
+            source.valid.eq(1),
+            source.data.eq(dri[dri_count]),
+            If(source.ready,
+                NextValue(dri_count, dri_count + 1),
+                If(dri_count == len(dri) - 1,
+                    NextValue(dri_count, 0),
+                    NextState("HEADER")
+                )
+            )
+        )
+        # 0xff in the entropy coded data is always followed by 0x00, so an
+        # 0xff is held until the next byte shows if it starts the EOI.
+        fsm.act("DATA",
+            If(sink.data == 0xff,
+                sink.ready.eq(1),
+                If(sink.valid,
+                    NextState("DATA_FF")
+                )
+            ).Else(
+                source.valid.eq(sink.valid),
+                source.data.eq(sink.data),
+                sink.ready.eq(source.ready)
+            )
+        )
+        fsm.act("DATA_FF",
+            If(sink.valid,
+                If(sink.data == 0xd9,
+                    sink.ready.eq(1),
+                    NextState("MARKER")
+                ).Else(
+                    source.valid.eq(1),
+                    source.data.eq(0xff),
+                    If(source.ready,
+                        NextState("DATA")
+                    )
+                )
+            )
+        )
+        fsm.act("MARKER",
+            source.valid.eq(1),
+            source.data.eq(Mux(marker_count, marker, 0xff)),
+            If(source.ready,
+                NextValue(marker_count, ~marker_count),
+                If(marker_count,
+                    NextValue(core, Mux(core == ncores - 1, 0, core + 1)),
+                    NextState("HEADER")
+                )
+            )
+        )
+
+
+def simulate_merge(stripes, h_width, v_width, seed=0):
+    """
+    Merge the JFIF streams (lists of bytes) of the stripes with a JFIFMerger
+    in simulation, with random gaps on the inputs and back-pressure on the
+    output.
+
+    >>> def jfif(lines, data):
+    ...     header = [0]*HEADER_SIZE
+    ...     header[:2] = [0xff, 0xd8]
+    ...     header[HEADER_SOF:HEADER_SOF + 2] = [0xff, 0xc0]
+    ...     header[HEADER_SIZE_Y:HEADER_SIZE_Y + 2] = [lines >> 8, lines & 0xff]
+    ...     return header + data + [0xff, 0xd9]
+    >>> stripes = [jfif(240, [1, 0xff, 0x00, 2]), jfif(240, [3]), jfif(240, [0xff, 0x00])]
+    >>> out = simulate_merge(stripes, 1280, 720)
+    >>> len(out) == HEADER_SIZE + 6 + 13
+    True
+    >>> [hex(b) for b in out[HEADER_SOF:HEADER_SOF + 8]] # DRI, 80x30 MCUs, SOF0
+    ['0xff', '0xdd', '0x0', '0x4', '0x9', '0x60', '0xff', '0xc0']
+    >>> out[HEADER_SIZE_Y + 6:HEADER_SIZE_Y + 8] == [720 >> 8, 720 & 0xff]
+    True
+    >>> [hex(b) for b in out[HEADER_SIZE + 6:]]
+    ['0x1', '0xff', '0x0', '0x2', '0xff', '0xd0', '0x3', '0xff', '0xd1', '0xff', '0x0', '0xff', '0xd9']
+    >>> all(simulate_merge(stripes, 1280, 720, seed) == out for seed in range(1, 8))
+    True
+    """
+    rnd = random.Random(seed)
+    dut = JFIFMerger(len(stripes))
+    out = []
+
+    @passive
+    def send(sink, data):
+        for b in data:
+            while rnd.random() < 0.3:
+                # data is not looked at without valid
+                yield sink.valid.eq(0)
+                yield sink.data.eq(0xd9)
+                yield
+            yield sink.valid.eq(1)
+            yield sink.data.eq(b)
+            yield
+            while not (yield sink.ready):
+                yield
+        yield sink.valid.eq(0)
+
+    def receive():
+        yield dut.h_width.eq(h_width)
+        yield dut.v_width.eq(v_width)
+        while out[-2:] != [0xff, 0xd9]:
+            yield dut.source.ready.eq(rnd.random() < 0.7)
+            yield
+            if (yield dut.source.valid) and (yield dut.source.ready):
+                out.append((yield dut.source.data))
+
+    generators = [send(sink, data) for sink, data in zip(dut.sinks, stripes)]
+    run_simulation(dut, generators + [receive()])
+    return out
+
+
+class _StripeBuffer(Module):
+    """
+    DRAM FIFO (in sys) for the JFIF stream of a stripe. The EOI of each
+    frame ends a DRAM word, and the rest of that word is dropped on the way
+    out.
+    """
+    def __init__(self, write_port, read_port, base, size):
+        self.sink = sink = stream.Endpoint([("data", 8)])
+        self.source = source = stream.Endpoint([("data", 8)])
+
+        # # #
+
+        ratio = write_port.dw//8
+        depth = size//ratio
+        base = base//ratio
+
+        self.submodules.writer = writer = LiteDRAMDMAWriter(write_port)
+        self.submodules.reader = reader = LiteDRAMDMAReader(read_port)
+        self.submodules.pack = pack = stream.Converter(8, write_port.dw)
+        self.submodules.unpack = unpack = stream.Converter(read_port.dw, 8)
+
+        # write, flushing the word at the EOI
+        sink_ff = Signal()
+        self.sync += If(sink.valid & sink.ready, sink_ff.eq(sink.data == 0xff))
+        self.comb += [
+            sink.connect(pack.sink, omit={"last"}),
+            pack.sink.last.eq(sink_ff & (sink.data == 0xd9))
+        ]
+
+        # used counts the words from the write command to the read command
+        # so a word isn't overwritten before it's read, level only the words
+        # the controller has taken the data for, so the reader can't get
+        # ahead of the writes.
+        used = Signal(max=depth + 1)
+        level = Signal(max=depth + 1)
+        write_adr = Signal(max=depth)
+        read_adr = Signal(max=depth)
+        self.comb += [
+            writer.sink.valid.eq(pack.source.valid & (used != depth)),
+            writer.sink.address.eq(base + write_adr),
+            writer.sink.data.eq(pack.source.data),
+            pack.source.ready.eq(writer.sink.ready & (used != depth)),
+            reader.sink.valid.eq(level != 0),
+            reader.sink.address.eq(base + read_adr),
+            reader.source.connect(unpack.sink)
+        ]
+        write = writer.sink.valid & writer.sink.ready
+        written = write_port.wdata.valid & write_port.wdata.ready
+        read = reader.sink.valid & reader.sink.ready
+        self.sync += [
+            If(write,
+                write_adr.eq(Mux(write_adr == depth - 1, 0, write_adr + 1))
+            ),
+            If(read,
+                read_adr.eq(Mux(read_adr == depth - 1, 0, read_adr + 1))
+            ),
+            If(write & ~read,
+                used.eq(used + 1)
+            ).Elif(read & ~write,
+                used.eq(used - 1)
+            ),
+            If(written & ~read,
+                level.eq(level + 1)
+            ).Elif(read & ~written,
+                level.eq(level - 1)
+            )
+        ]
+
+        # read, dropping the end of the word after the EOI
+        byte = Signal(max=max(ratio, 2))
+        source_ff = Signal()
+        padding = Signal()
+        self.comb += \
+            If(padding,
+                unpack.source.ready.eq(1)
+            ).Else(
+                source.valid.eq(unpack.source.valid),
+                source.data.eq(unpack.source.data),
+                unpack.source.ready.eq(source.ready)
+            )
+        self.sync += \
+            If(unpack.source.valid & unpack.source.ready,
+                byte.eq(Mux(byte == ratio - 1, 0, byte + 1)),
+                source_ff.eq(~padding & (unpack.source.data == 0xff)),
+                If(~padding & source_ff & (unpack.source.data == 0xd9),
+                    padding.eq(1)
+                ),
+                If(byte == ratio - 1,
+                    padding.eq(0)
+                )
+            )
+
+
+class MultiEncoder(Module):
+    """
+    ncores buffer + Encoder pipelines (in the encoder clock domain) fed from
+    the sys clock domain stripe streams, merged into one JFIF stream.
+    buffer_ports are the (write, read) DRAM ports of the stripe FIFOs of
+    cores 1 to ncores - 1, from base in main RAM (see stripe_buffer_base);
+    a stripe bigger than stripe_size only holds its core until the merger
+    gets to it.
+    """
+    def __init__(self, platform, sinks, buffer_ports, base, nslots=16,
+                 stripe_size=STRIPE_BUFFER_SIZE):
+        ncores = len(sinks)
+        assert len(buffer_ports) == ncores - 1
+        self.source = stream.Endpoint([("data", 8)])
+        self.buffers = []
+
+        # # #
+
+        self.submodules.merger = merger = ClockDomainsRenamer("encoder")(JFIFMerger(ncores))
+        buses = []
+        for i, sink in enumerate(sinks):
+            cdc = stream.AsyncFIFO([("data", 128)], 4)
+            cdc = ClockDomainsRenamer({"write": "sys", "read": "encoder"})(cdc)
+            buf = EncoderMultiBuffer(nslots=nslots)
+            encoder = Encoder(platform)
+            self.submodules += cdc, buf, encoder
+            self.buffers.append(buf)
+            self.comb += [
+                sink.connect(cdc.sink),
+                cdc.source.connect(buf.sink),
+                buf.source.connect(encoder.sink)
+            ]
+            buses.append(encoder.bus)
+
+            # The merger starts with core 0, the others are kept in DRAM
+            # until it gets to them.
+            if i == 0:
+                self.comb += encoder.source.connect(merger.sinks[i])
+                continue
+            write_port, read_port = buffer_ports[i - 1]
+            stripe = _StripeBuffer(write_port, read_port,
+                                   base + (i - 1)*stripe_size, stripe_size)
+            to_sys = stream.AsyncFIFO([("data", 8)], 16)
+            to_sys = ClockDomainsRenamer({"write": "encoder", "read": "sys"})(to_sys)
+            from_sys = stream.AsyncFIFO([("data", 8)], 16)
+            from_sys = ClockDomainsRenamer({"write": "sys", "read": "encoder"})(from_sys)
+            self.submodules += stripe, to_sys, from_sys
+            self.comb += [
+                encoder.source.connect(to_sys.sink),
+                to_sys.source.connect(stripe.sink),
+                stripe.source.connect(from_sys.sink),
+                from_sys.source.connect(merger.sinks[i])
+            ]
+
+        self.submodules.broadcast = broadcast = EncoderBroadcast(buses)
+        self.bus = broadcast.bus
+        self.specials += [
+            MultiReg(broadcast.h_width, merger.h_width, "encoder"),
+            MultiReg(broadcast.v_width, merger.v_width, "encoder")
+        ]
+        self.comb += merger.source.connect(self.source)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,108 @@
+"""
+Rate control for the JPEG encoder; picks the quality for the next frame
+from the size of the frames already encoded, so the MJPEG stream stays
+under target_bitrate whatever the scene.
+
+The quantization tables for each quality are in the firmware (encoder.c),
+which writes them before every frame, so this only chooses which one;
+with target_bitrate set the firmware uses quality rather than the quality
+set from the console.
+
+The budget is a leaky bucket in sys clock cycles; every cycle earns
+target_bitrate and every frame costs 8*clk_freq per byte, so the bucket
+stays level when the stream runs at exactly target_bitrate bits per
+second, with no division needed. A frame leaving the bucket in debt drops
+the quality one step, and the quality goes back up a step once there is a
+whole frame's worth of credit.
+"""
+
+from migen import *
+from migen.genlib.cdc import MultiReg, PulseSynchronizer
+
+from litex.soc.interconnect.csr import *
+
+from gateware.encoder.stats import EncoderFrameSize
+
+
+class EncoderRateControl(Module, AutoCSR):
+    def __init__(self, encoder, clk_freq, qualities=(100, 85, 75, 50), cd="encoder"):
+        self.target_bitrate = CSRStorage(32)
+        self.quality = CSRStatus(8)
+        self.frame_bytes = CSRStatus(32)
+
+        # # #
+
+        self.submodules.size = size = ClockDomainsRenamer(cd)(EncoderFrameSize())
+        self.comb += [
+            size.source_valid.eq(encoder.source.valid),
+            size.source_ready.eq(encoder.source.ready),
+            size.source_data.eq(encoder.source.data)
+        ]
+
+        # frame_bytes only changes with frame_done, and the pulse takes
+        # longer to get through than the MultiReg.
+        frame_done = PulseSynchronizer(cd, "sys")
+        self.submodules += frame_done
+        self.comb += frame_done.i.eq(size.frame_done)
+        self.specials += MultiReg(size.frame_bytes, self.frame_bytes.status)
+        new_frame = Signal()
+        self.sync += new_frame.eq(frame_done.o)
+
+        # The 64 bit multiply and the 65 bit compares each get a cycle;
+        # cost is registered on new_frame, taken off the credit on debit and
+        # the credit left is checked on check.
+        cost = Signal(64)
+        neg_cost = Signal((65, True))
+        debit = Signal()
+        check = Signal()
+        self.sync += [
+            If(new_frame,
+                cost.eq(self.frame_bytes.status*(8*clk_freq))
+            ),
+            neg_cost.eq(-cost),
+            debit.eq(new_frame),
+            check.eq(debit)
+        ]
+
+        credit = Signal((65, True))
+        credit_next = Signal((66, True))
+        limit = Signal(65)
+        level = Signal(max=len(qualities))
+        self.comb += [
+            credit_next.eq(credit + self.target_bitrate.storage - Mux(debit, cost, 0)),
+            self.quality.status.eq(Array(qualities)[level])
+        ]
+
+        self.sync += [
+            If(self.target_bitrate.storage == 0,
+                credit.eq(0),
+                limit.eq(0),
+                level.eq(0)
+            ).Elif(debit,
+                # At most a frame of debt and two of credit are kept
+                limit.eq(cost << 1),
+                credit.eq(credit_next)
+            ).Elif(check,
+                If(credit < 0,
+                    If(level != len(qualities) - 1,
+                        level.eq(level + 1)
+                    ),
+                    If(credit < neg_cost,
+                        credit.eq(neg_cost)
+                    ).Else(
+                        credit.eq(credit_next)
+                    )
+                ).Elif(credit >= cost,
+                    If(level != 0,
+                        level.eq(level - 1)
+                    ),
+                    credit.eq(credit_next)
+                ).Else(
+                    credit.eq(credit_next)
+                )
+            ).Elif(credit_next < limit,
+                credit.eq(credit_next)
+            ).Else(
+                credit.eq(limit)
+            )
+        ]
@@ -0,0 +1,195 @@
+"""
+Performance counters for the encoder pipeline, to find which of DRAM, the
+DCT, the entropy coder or the USB link limits the frame rate.
+
+All the counters run freely (and wrap); writing update takes a snapshot of
+all of them at once, which is what the CSRs show, so the host computes
+rates from the difference between two snapshots.
+"""
+
+from migen import *
+from migen.genlib.cdc import MultiReg, PulseSynchronizer
+
+from litex.soc.interconnect.csr import *
+
+
+class EncoderFrameSize(Module):
+    """
+    Size of the JPEG frames out of an encoder; a frame ends with its EOI
+    (0xff 0xd9), eoi is high while that last byte is taken, and frame_done
+    pulses the next cycle with frame_bytes updated.
+    """
+    def __init__(self):
+        self.source_valid = Signal()
+        self.source_ready = Signal()
+        self.source_data = Signal(8)
+
+        self.eoi = Signal()
+        self.frame_bytes = Signal(32)
+        self.frame_done = Signal()
+
+        # # #
+
+        last_ff = Signal()
+        count = Signal(32)
+        self.comb += self.eoi.eq(self.source_valid & self.source_ready &
+                                 last_ff & (self.source_data == 0xd9))
+        self.sync += [
+            self.frame_done.eq(self.eoi),
+            If(self.source_valid & self.source_ready,
+                count.eq(count + 1),
+                last_ff.eq(self.source_data == 0xff)
+            ),
+            If(self.eoi,
+                self.frame_bytes.eq(count + 1),
+                count.eq(0)
+            )
+        ]
+
+
+class _EncoderStatsCore(Module):
+    def __init__(self):
+        # Encoder signals
+        self.sink_valid = Signal()
+        self.sink_ready = Signal()
+        self.source_valid = Signal()
+        self.source_ready = Signal()
+        self.source_data = Signal(8)
+        self.fdct_fifo_hf_full = Signal()
+        self.output_fifo_almost_full = Signal()
+
+        self.update = Signal()
+
+        self.cycles = Signal(32)
+        self.frames = Signal(32)
+        self.bytes = Signal(32)
+        self.frame_bytes = Signal(32)
+        self.fdct_stall = Signal(32)
+        self.output_full = Signal(32)
+        self.usb_backpressure = Signal(32)
+
+        # # #
+
+        self.submodules.size = size = EncoderFrameSize()
+        self.comb += [
+            size.source_valid.eq(self.source_valid),
+            size.source_ready.eq(self.source_ready),
+            size.source_data.eq(self.source_data)
+        ]
+
+        cycles = Signal(32)
+        frames = Signal(32)
+        nbytes = Signal(32)
+        fdct_stall = Signal(32)
+        output_full = Signal(32)
+        usb_backpressure = Signal(32)
+
+        # A frame is being encoded from its first input word until the EOI
+        # (0xff 0xd9) leaves the encoder; the JpegEnc waiting on
+        # fdct_fifo_hf_full outside of that is just idle.
+        encoding = Signal()
+
+        self.sync += [
+            cycles.eq(cycles + 1),
+            If(self.sink_valid & self.sink_ready,
+                encoding.eq(1)
+            ),
+            If(encoding & ~self.fdct_fifo_hf_full,
+                fdct_stall.eq(fdct_stall + 1)
+            ),
+            If(self.output_fifo_almost_full,
+                output_full.eq(output_full + 1)
+            ),
+            If(self.source_valid & ~self.source_ready,
+                usb_backpressure.eq(usb_backpressure + 1)
+            ),
+            If(self.source_valid & self.source_ready,
+                nbytes.eq(nbytes + 1)
+            ),
+            If(size.eoi,
+                encoding.eq(0),
+                frames.eq(frames + 1)
+            ),
+            If(self.update,
+                self.cycles.eq(cycles),
+                self.frames.eq(frames),
+                self.bytes.eq(nbytes),
+                self.frame_bytes.eq(size.frame_bytes),
+                self.fdct_stall.eq(fdct_stall),
+                self.output_full.eq(output_full),
+                self.usb_backpressure.eq(usb_backpressure)
+            )
+        ]
+
+
+class EncoderStats(Module, AutoCSR):
+    """
+    Counters for an Encoder (in clock domain cd) and the reader feeding it
+    (in sys);
+
+    - cycles: encoder clock cycles.
+    - frames / bytes: JPEG frames and bytes out of the encoder.
+    - frame_bytes: size of the last complete frame.
+    - fdct_stall: cycles the JpegEnc waited for pixels (fdct_fifo_hf_full
+      low) while encoding a frame.
+    - output_full: cycles the JpegEnc was held by output_fifo_almost_full.
+    - usb_backpressure: cycles the encoder output was not taken.
+    - sys_cycles / dma_wait: sys clock cycles, and those the reader was busy
+      without data for the encoder (waiting for DRAM).
+    """
+    def __init__(self, encoder, reader, cd="encoder"):
+        self.update = CSR()
+        self.submodules.core = core = ClockDomainsRenamer(cd)(_EncoderStatsCore())
+
+        self.cycles = CSRStatus(32)
+        self.frames = CSRStatus(32)
+        self.bytes = CSRStatus(32)
+        self.frame_bytes = CSRStatus(32)
+        self.fdct_stall = CSRStatus(32)
+        self.output_full = CSRStatus(32)
+        self.usb_backpressure = CSRStatus(32)
+        self.sys_cycles = CSRStatus(32)
+        self.dma_wait = CSRStatus(32)
+
+        # # #
+
+        self.comb += [
+            core.sink_valid.eq(encoder.sink.valid),
+            core.sink_ready.eq(encoder.sink.ready),
+            core.source_valid.eq(encoder.source.valid),
+            core.source_ready.eq(encoder.source.ready),
+            core.source_data.eq(encoder.source.data),
+            core.fdct_fifo_hf_full.eq(encoder.fdct_fifo_hf_full),
+            core.output_fifo_almost_full.eq(encoder.output_fifo_almost_full)
+        ]
+
+        update = PulseSynchronizer("sys", cd)
+        self.submodules += update
+        self.comb += [
+            update.i.eq(self.update.re),
+            core.update.eq(update.o)
+        ]
+        # The snapshots only change on update, so they are stable by the
+        # time they are read.
+        self.specials += [
+            MultiReg(core.cycles, self.cycles.status),
+            MultiReg(core.frames, self.frames.status),
+            MultiReg(core.bytes, self.bytes.status),
+            MultiReg(core.frame_bytes, self.frame_bytes.status),
+            MultiReg(core.fdct_stall, self.fdct_stall.status),
+            MultiReg(core.output_full, self.output_full.status),
+            MultiReg(core.usb_backpressure, self.usb_backpressure.status)
+        ]
+
+        sys_cycles = Signal(32)
+        dma_wait = Signal(32)
+        self.sync += [
+            sys_cycles.eq(sys_cycles + 1),
+            If(~reader.done.status & ~reader.source.valid,
+                dma_wait.eq(dma_wait + 1)
+            ),
+            If(self.update.re,
+                self.sys_cycles.status.eq(sys_cycles),
+                self.dma_wait.status.eq(dma_wait)
+            )
+        ]
@@ -0,0 +1,109 @@
+"""
+CRC32 of a range of memory, so the host can verify the contents of DRAM or
+the SPI flash without reading them back over the (slow) debug link.
+"""
+
+from functools import reduce
+from operator import xor
+
+from migen import *
+
+from litex.soc.interconnect import wishbone
+from litex.soc.interconnect.csr import *
+
+
+CRC32_POLYNOM = 0xedb88320 # reflected, as zlib / Ethernet
+
+
+def crc32_equations(data_width=32):
+    """
+    For each bit of the next CRC, the bits of the current CRC (0-31) and of
+    the data (32-) which are XORed together. Data is shifted in LSB first
+    (like zlib.crc32 does for each byte).
+    """
+    # Each bit is the set of inputs XORed together to get it.
+    crc = [{i} for i in range(32)]
+    for d in range(data_width):
+        feedback = crc[0] ^ {32 + d}
+        crc = crc[1:] + [set()]
+        for i in range(32):
+            if (CRC32_POLYNOM >> i) & 1:
+                crc[i] = crc[i] ^ feedback
+    return crc
+
+
+class MemoryHash(Module, AutoCSR):
+    """
+    Reads length bytes (a multiple of 4) from base through a Wishbone
+    master and computes the same CRC32 as zlib.crc32 over them. Bytes are
+    taken from each word in the order given by endianness.
+
+    A read which isn't acked within timeout cycles (nothing mapped there)
+    or is answered with err stops the hash and sets error, rather than
+    holding the bus forever.
+    """
+    def __init__(self, endianness="big", timeout=2**16):
+        self.bus = bus = wishbone.Interface()
+
+        self.base = CSRStorage(32)
+        self.length = CSRStorage(32)
+        self.start = CSR()
+        self.done = CSRStatus()
+        self.result = CSRStatus(32)
+        self.error = CSRStatus()
+
+        # # #
+
+        address = Signal(30)
+        wait = Signal(max=timeout + 1)
+        remaining = Signal(30)
+        crc = Signal(32, reset=0xffffffff)
+        crc_next = Signal(32)
+
+        # Bytes in memory order
+        data = Signal(32)
+        if endianness == "big":
+            self.comb += data.eq(Cat(*[bus.dat_r[8*(3-i):8*(4-i)] for i in range(4)]))
+        else:
+            self.comb += data.eq(bus.dat_r)
+
+        inputs = Cat(crc, data)
+        for i, terms in enumerate(crc32_equations(32)):
+            self.comb += crc_next[i].eq(reduce(xor, [inputs[t] for t in sorted(terms)]))
+
+        self.comb += self.result.status.eq(~crc)
+
+        fsm = FSM(reset_state="IDLE")
+        self.submodules += fsm
+        fsm.act("IDLE",
+            self.done.status.eq(1),
+            If(self.start.re,
+                NextValue(address, self.base.storage[2:]),
+                NextValue(remaining, self.length.storage[2:]),
+                NextValue(crc, crc.reset),
+                NextValue(self.error.status, 0),
+                NextValue(wait, 0),
+                NextState("READ")
+            )
+        )
+        fsm.act("READ",
+            If(remaining == 0,
+                NextState("IDLE")
+            ).Else(
+                bus.stb.eq(1),
+                bus.cyc.eq(1),
+                bus.we.eq(0),
+                bus.sel.eq(0xf),
+                bus.adr.eq(address),
+                NextValue(wait, wait + 1),
+                If(bus.ack,
+                    NextValue(crc, crc_next),
+                    NextValue(address, address + 1),
+                    NextValue(remaining, remaining - 1),
+                    NextValue(wait, 0)
+                ).Elif(bus.err | (wait == timeout),
+                    NextValue(self.error.status, 1),
+                    NextState("IDLE")
+                )
+            )
+        )
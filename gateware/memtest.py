@@ -2,6 +2,8 @@
 
 from migen import *
 
+from litex.soc.interconnect.csr import AutoCSR, CSRStatus
+
 
 class LiteDRAMBISTCheckerScope(Module):
     """Easy scope access to important signals of LiteDRAMBISTChecker."""
@@ -28,3 +30,32 @@ class LiteDRAMBISTCheckerScope(Module):
             self.data_expected,
             self.data_actual,
         ]
+
+
+class LiteDRAMBISTTimer(Module, AutoCSR):
+    """Count the sys_clk cycles taken by the last generator / checker run."""
+
+    def __init__(self, generator, checker, clk_freq):
+        self.clk_freq = CSRStatus(32, reset=int(clk_freq))
+        self.generator_cycles = CSRStatus(32)
+        self.checker_cycles = CSRStatus(32)
+
+        for bist, cycles in ((generator, self.generator_cycles),
+                             (checker, self.checker_cycles)):
+            running = Signal()
+            done_d = Signal()
+            # done can still be high for a few cycles after start, so stop
+            # on its rising edge.
+            self.sync += [
+                done_d.eq(bist.done.status),
+                If(bist.start.re,
+                    running.eq(1),
+                    cycles.status.eq(0),
+                ).Elif(running,
+                    If(bist.done.status & ~done_d,
+                        running.eq(0),
+                    ).Else(
+                        cycles.status.eq(cycles.status + 1),
+                    )
+                )
+            ]
@@ -1,8 +1,17 @@
 #!/usr/bin/env python3
 
+import startup_profile
+
 import argparse
+import hashlib
+import inspect
+import json
 import os
 
+import build_cache
+import checkpoint
+import registry
+
 from litex.build.tools import write_to_file
 from litex.soc.integration.soc_sdram import *
 from litex.soc.integration.builder import *
@@ -25,6 +34,8 @@ def get_args(parser, platform='opsis', target='hdmi2usb'):
     parser.add_argument("--no-compile-firmware", action="store_true", help="do not compile the firmware")
     parser.add_argument("--override-firmware", action="store", default=None, help="override firmware with file")
 
+    parser.add_argument("--profile-startup", nargs="?", const="-", default=None, metavar="FILE", help="report startup timings (json written to FILE or stderr)")
+
 
 def get_builddir(args):
     assert args.platform is not None
@@ -46,24 +57,30 @@ def get_testdir(args):
     return testdir
 
 
+def get_checkpointdir(args):
+    return os.path.join(get_builddir(args), "checkpoint")
+
+
 def get_platform(args):
     assert args.platform is not None
-    exec("from platforms.{} import Platform".format(args.platform), globals())
-    return Platform(**dict(args.platform_option))
+    with startup_profile.phase("platform"):
+        Platform = registry.load_platform(args.platform)
+        return Platform(**dict(args.platform_option))
 
 
 def get_soc(args, platform):
-    exec("from targets.{}.{} import SoC".format(args.platform, args.target.lower(), args.target), globals())
-    soc = SoC(platform, ident=SoC.__name__, **soc_sdram_argdict(args), **dict(args.target_option))
-    if hasattr(soc, 'configure_iprange'):
-        soc.configure_iprange(args.iprange)
-    if hasattr(soc, "add_sdcard"):
-        soc.add_sdcard()
-        print("New clock:", soc.sys_clk_freq)
-        # exit()
-    else:
-        print("Buuuh")
-        exit()
+    with startup_profile.phase("soc"):
+        SoC = registry.load_soc(args.platform, args.target.lower())
+        soc = SoC(platform, ident=SoC.__name__, **soc_sdram_argdict(args), **dict(args.target_option))
+        if hasattr(soc, 'configure_iprange'):
+            soc.configure_iprange(args.iprange)
+        if hasattr(soc, "add_sdcard"):
+            soc.add_sdcard()
+            print("New clock:", soc.sys_clk_freq)
+            # exit()
+        else:
+            print("Buuuh")
+            exit()
     return soc
 
 
@@ -105,6 +122,84 @@ def get_bios_maxsize(args, soc):
     return 0x8000
 
 
+FLASH_LAYOUT_KEYS = (
+    "gateware_size",
+    "spiflash_total_size",
+    "spiflash_page_size",
+    "spiflash_sector_size",
+)
+
+
+def get_flash_layout_file(builddir):
+    return os.path.join(builddir, "flash-layout.json")
+
+
+def write_flash_layout(args, soc):
+    layout = {k: getattr(soc.platform, k, None) for k in FLASH_LAYOUT_KEYS}
+    layout["bios_maxsize"] = get_bios_maxsize(args, soc)
+    layout["options"] = build_cache.get_option_key(args)
+    layout["sources"] = {f: _file_hash(f) for f in _flash_layout_sources(soc)}
+    filename = get_flash_layout_file(get_builddir(args))
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, "w") as f:
+        json.dump(layout, f, indent=2, sort_keys=True)
+
+
+def _file_hash(filename):
+    with open(filename, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _flash_layout_sources(soc):
+    """
+    The files the layout depends on; make.py and the modules of every class
+    the SoC and the platform are built from (targets/<p>/base.py sets the
+    ROM size the BIOS size comes from, for example).
+    """
+    sources = {os.path.abspath(__file__)}
+    for cls in type(soc).__mro__ + type(soc.platform).__mro__:
+        try:
+            sources.add(os.path.abspath(inspect.getsourcefile(cls)))
+        except TypeError:
+            # builtins (object)
+            pass
+    return sorted(sources)
+
+
+def read_flash_layout(args):
+    """Returns the flash layout written by the build, or None if missing or stale."""
+    filename = get_flash_layout_file(get_builddir(args))
+    if not os.path.exists(filename):
+        return None
+    with open(filename) as f:
+        layout = json.load(f)
+    if layout.get("options") != build_cache.get_option_key(args):
+        return None
+    if not layout.get("sources"):
+        return None
+    for source, digest in layout["sources"].items():
+        if not os.path.exists(source) or _file_hash(source) != digest:
+            return None
+    return layout
+
+
+def get_flash_layout(args):
+    """
+    Flash geometry and BIOS size, without elaborating the SoC when the
+    build already recorded them.
+    """
+    layout = read_flash_layout(args)
+    if layout is not None:
+        return layout
+    print("No (or stale) {}, elaborating the SoC.".format(
+        get_flash_layout_file(get_builddir(args))))
+    platform = get_platform(args)
+    soc = get_soc(args, platform)
+    layout = {k: getattr(platform, k, None) for k in FLASH_LAYOUT_KEYS}
+    layout["bios_maxsize"] = get_bios_maxsize(args, soc)
+    return layout
+
+
 def get_firmware(builddir, filetype="flash"):
     basedir = os.path.join(builddir, "software", "firmware", "firmware")
     if filetype in ("load",):
@@ -117,24 +212,15 @@ def get_firmware(builddir, filetype="flash"):
         assert False, "Unknown file type %s" % filetype
 
 
-def main():
-    parser = argparse.ArgumentParser(description="Opsis LiteX SoC", conflict_handler='resolve')
-    get_args(parser)
-    builder_args(parser)
-    soc_sdram_args(parser)
-
-    args = parser.parse_args()
-
-    platform = get_platform(args)
-
-    soc = get_soc(args, platform)
-
+def build(args, platform, soc, run=True):
     builddir = get_builddir(args)
     testdir = get_testdir(args)
 
     buildargs = builder_argdict(args)
     if not buildargs.get('output_dir', None):
         buildargs['output_dir'] = builddir
+    if not run:
+        buildargs['compile_gateware'] = False
 
     if hasattr(soc, 'cpu_type'):
         if not buildargs.get('csr_csv', None):
@@ -157,7 +243,51 @@ def main():
                 builder.add_software_package("stub", "{}/firmware/stub".format(os.getcwd()))
         vns = builder.build(**dict(args.build_option))
     else:
-        vns = platform.build(soc, build_dir=os.path.join(builddir, "gateware"))
+        vns = platform.build(soc, build_dir=os.path.join(builddir, "gateware"), run=run)
+
+    return vns
+
+
+def build_cached(args, platform, soc, cache_dir):
+    """
+    Only run the toolchain when the generated HDL isn't found in the cache.
+
+    Returns the soc and the namespace.
+    """
+    gateware_dir = os.path.join(
+        builder_argdict(args).get('output_dir', None) or get_builddir(args),
+        "gateware")
+
+    vns = build(args, platform, soc, run=False)
+    key = build_cache.get_key(args, platform, gateware_dir)
+    if build_cache.restore(cache_dir, key, gateware_dir):
+        print("Build cache hit: {}".format(key))
+        return soc, vns
+
+    print("Build cache miss: {}".format(key))
+    # The first pass already wrote everything the toolchain needs.
+    if checkpoint.run_toolchain(platform, gateware_dir) != 0:
+        raise OSError("Toolchain failed, see {}".format(gateware_dir))
+    build_cache.store(cache_dir, key, gateware_dir)
+    return soc, vns
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="Opsis LiteX SoC", conflict_handler='resolve')
+    get_args(parser)
+    builder_args(parser)
+    soc_sdram_args(parser)
+    parser.add_argument("--cache-dir", default=None, help="gateware build cache directory (default $LITEX_BUILD_CACHE)")
+    parser.add_argument("--checkpoint", action="store_true", help="elaborate and save a checkpoint, don't run the toolchain")
+    parser.add_argument("--from-checkpoint", default=None, help="only run the toolchain from the given checkpoint (-Ob overrides toolchain options)")
+    return parser
+
+
+def export(args, soc, vns):
+    builddir = get_builddir(args)
+    testdir = get_testdir(args)
+
+    write_flash_layout(args, soc)
 
     if hasattr(soc, 'pcie_phy'):
         from litex.soc.integration.export import get_csr_header, get_soc_header
@@ -172,5 +302,42 @@ def main():
         soc.do_exit(vns, filename="{}/analyzer.csv".format(testdir))
 
 
+def main():
+    startup_profile.imports_done()
+    parser = get_parser()
+    args = parser.parse_args()
+
+    if args.from_checkpoint:
+        gateware_dir = os.path.join(get_builddir(args), "gateware")
+        exit(checkpoint.run(args.from_checkpoint, gateware_dir, dict(args.build_option)))
+
+    platform = get_platform(args)
+
+    soc = get_soc(args, platform)
+
+    if args.checkpoint:
+        vns = build(args, platform, soc, run=False)
+        checkpoint.write(
+            args, platform, soc,
+            os.path.join(get_builddir(args), "gateware"),
+            get_testdir(args),
+            get_checkpointdir(args))
+        print("Checkpoint: {}".format(get_checkpointdir(args)))
+        export(args, soc, vns)
+        startup_profile.report(args, "make.py")
+        return
+
+    with startup_profile.phase("build"):
+        cache_dir = build_cache.get_cache_dir(args)
+        if cache_dir and not args.no_compile_gateware:
+            soc, vns = build_cached(args, platform, soc, cache_dir)
+        else:
+            vns = build(args, platform, soc)
+
+        export(args, soc, vns)
+
+    startup_profile.report(args, "make.py")
+
+
 if __name__ == "__main__":
     main()
@@ -3,8 +3,12 @@
 Flash image creation tool.
 """
 
+import startup_profile
+
 import os
 import argparse
+import hashlib
+import json
 
 import make
 
@@ -63,8 +67,23 @@ def get_regions(size_gw, size_bios, size_flash):
     return [region_gw, region_bios, region_fw]
 
 
-def fill_region(image_fileobj, region, input_filename, fill_zero=False):
+# Size of the chunks used to copy input files into the image.
+CHUNK_SIZE = 1024*1024
+
+
+def hexdump_head(data):
+    """
+    >>> hexdump_head(bytes(range(4)))
+    '00 01 02 03'
+    """
+    return " ".join("{:02x}".format(i) for i in data[:64])
+
+
+def fill_region(f, region, input_filename, input_data=None, desc=None):
     """
+    Copy input_filename (or input_data if there is no file) into region of
+    the image file f, in chunks. Returns the number of bytes written and
+    their SHA256.
 
     Output;
     -----
@@ -74,35 +93,87 @@ def fill_region(image_fileobj, region, input_filename, fill_zero=False):
 
     {name  } @ {start   } (using {input_len} bytes of {length  } bytes) {input_fn} - {desc}
     {hex file data}
-    """
 
-    if inputfile:
-        input_data   = open(input_filename, "rb").read()
-        input_size   = len(input_data)
-        input_result = "Loaded from {}".format(input_filename)
+    >>> import io
+    >>> f = io.BytesIO()
+    >>> r = Region("BIOS", "LiteX BIOS with CRC", 8, 8)
+    >>> size, sha256 = fill_region(f, r, None, b"\\x01\\x02", "Cleared")
+        BIOS @ 0x00000008 (using          2 bytes of          8 bytes) Cleared                                                      - LiteX BIOS with CRC
+    01 02
+    >>> size, sha256[:16], f.getvalue()
+    (2, 'a12871fee210fb86', b'\\x00\\x00\\x00\\x00\\x00\\x00\\x00\\x00\\x01\\x02')
+    """
+    if input_filename:
+        src = open(input_filename, "rb")
+        chunks = iter(lambda: src.read(CHUNK_SIZE), b"")
+        input_result = input_filename
     else:
-        input_data   = b""
-        input_size   = len(input_data)
-        input_result = "Skipped"
+        src = None
+        chunks = [input_data or b""]
+        input_result = desc
+
+    h = hashlib.sha256()
+    head = b""
+    input_size = 0
+    # Seeking past the end leaves a hole which reads back as zeros (and is
+    # sparse on most filesystems), so gaps between regions cost nothing.
+    f.seek(region.start)
+    for chunk in chunks:
+        input_size += len(chunk)
+        assert input_size < region.size, (
+            "{} ({} bytes) doesn't fit in the {} region ({} bytes)".format(
+                input_result, input_size, region.name, region.size))
+        if len(head) < 64:
+            head += chunk[:64-len(head)]
+        h.update(chunk)
+        f.write(chunk)
+    if src:
+        src.close()
+
+    print("{:>8s} @ 0x{:08x} (using {:10} bytes of {:10} bytes) {:60} - {}".format(
+        region.name, region.start, input_size, region.size, input_result, region.desc))
+    print(hexdump_head(head))
+    return input_size, h.hexdigest()
+
+
+def get_manifest_file(image_file):
+    """
+    >>> get_manifest_file("build/x/image-gateware+bios+firmware.bin")
+    'build/x/image-gateware+bios+firmware.manifest.json'
+    """
+    return os.path.splitext(image_file)[0] + ".manifest.json"
 
-    #   "{name:08s} @ 0x{start:08x} "
-    #   "(using {input_size:10} bytes of {:10} bytes - {:02.2)%) {:60s} - {}"
 
-    #print(
-    #    "{:08s} @ 0x{:08x} (using {:10} bytes of {:10} bytes - {:02.2)% {:60s} - {}"
-    #).format()
+def write_manifest(image_file, regions):
+    """regions is a list of (Region, source path, size, sha256)."""
+    manifest = {
+        "image": os.path.basename(image_file),
+        "regions": [{
+            "name": region.name,
+            "offset": region.start,
+            "size": size,
+            "sha256": sha256,
+            "source": source,
+        } for region, source, size, sha256 in regions],
+    }
+    with open(get_manifest_file(image_file), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def read_manifest(image_file):
+    with open(get_manifest_file(image_file)) as f:
+        return json.load(f)
 
-    print(" ".join("{:02x}".format(i) for i in input_data[:64]))
-    assert input_size < region.size
-    assert f.tell() < region.start, "{} < {}".format(f.tell(), region.start)
-    f.seek(region.start)
-    f.write(input_data)
-    if fill_zero:
-        while f.tell() < region.end:
-            f.write('\0')
+
+def fill_bytes(f, end, value=b"\xff"):
+    """Fill from the current position up to end with value, in chunks."""
+    chunk = value * CHUNK_SIZE
+    while f.tell() < end:
+        f.write(chunk[:end - f.tell()])
 
 
 def main():
+    startup_profile.imports_done()
     parser = argparse.ArgumentParser(description=__doc__)
     make.get_args(parser)
 
@@ -161,98 +232,58 @@ def main():
         assert firmware.endswith('.fbi'), (
             "Firmware must be a MiSoC .fbi image.")
 
-    platform = make.get_platform(args)
-    soc = make.get_soc(args, platform)
-    bios_size = make.get_bios_maxsize(args, soc)
-
-    gateware_pos = 0
-    bios_pos = platform.gateware_size
-    firmware_pos = platform.gateware_size + bios_size
+    layout = make.get_flash_layout(args)
+    gateware_size = layout["gateware_size"]
+    spiflash_total_size = layout["spiflash_total_size"]
+    bios_size = layout["bios_maxsize"]
 
-    flash_size = platform.spiflash_total_size
+    flash_size = spiflash_total_size
     if args.force_image_size and args.force_image_size.lower() not in ("true", "1"):
             flash_size = int(args.force_image_size)
 
+    region_gw, region_bios, region_fw = get_regions(gateware_size, bios_size, flash_size)
+    region_fw = region_fw._replace(
+        desc="{} Firmware in FBI format (loaded into DRAM)".format(args.firmware_name))
+
     print()
-    with open(output_file, "wb") as f:
+    with startup_profile.phase("write"), open(output_file, "wb") as f:
         # FPGA gateware
-        if gateware:
-            gateware_data = open(gateware, "rb").read()
-        else:
-            gateware_data = b""
-            gateware = "Skipped"
-
-        print(("Gateware @ 0x{:08x} (using {:10} bytes of {:10} bytes) {:60}"
-               " - FPGA Bitstream"
-               ).format(
-                   gateware_pos,
-                   len(gateware_data),
-                   bios_pos - gateware_pos,
-                   gateware))
-        print(" ".join("{:02x}".format(i) for i in gateware_data[:64]))
-        assert len(gateware_data) < platform.gateware_size
-        f.seek(0)
-        f.write(gateware_data)
-
-        if bios:
-            bios_data = open(bios, "rb").read()
-        else:
-            bios_data = b""
-            bios = "Skipped"
+        gateware_len, gateware_sha = fill_region(f, region_gw, gateware, desc="Skipped")
 
         # LiteX BIOS
-        assert len(bios_data) < bios_size
-        f.seek(bios_pos)
-        f.write(bios_data)
-        print(("    BIOS @ 0x{:08x} (using {:10} bytes of {:10} bytes) {:60}"
-               " - LiteX BIOS with CRC"
-               ).format(
-                   bios_pos,
-                   len(bios_data),
-                   firmware_pos - bios_pos,
-                   bios))
-        print(" ".join("{:02x}".format(i) for i in bios_data[:64]))
-
-        if firmware:
-            firmware_data = open(firmware, "rb").read()
-        else:
-            firmware_data = b"\xff\xff\xff\xff"
-            firmware = "Cleared"
-            #firmware_data = b""
-            #firmware = "Skipped"
+        bios_len, bios_sha = fill_region(f, region_bios, bios, desc="Skipped")
 
         # SoftCPU firmware
-        print(("Firmware @ 0x{:08x} (using {:10} bytes of {:10} bytes) {:60}"
-               " - {} Firmware in FBI format (loaded into DRAM)"
-               ).format(
-                   firmware_pos,
-                   len(firmware_data),
-                   flash_size - firmware_pos,
-                   firmware,
-                   args.firmware_name))
-        print(" ".join("{:02x}".format(i) for i in firmware_data[:64]))
-        f.seek(firmware_pos)
-        f.write(firmware_data)
+        firmware_len, firmware_sha = fill_region(
+            f, region_fw, firmware, b"\xff\xff\xff\xff", desc="Cleared")
 
         # Result
-        remain = platform.spiflash_total_size - (
-            firmware_pos+len(firmware_data))
+        remain = spiflash_total_size - (region_fw.start+firmware_len)
         print("-"*40)
         print(("       Remaining space {:10} bytes"
                " ({} Megabits, {:.2f} Megabytes)"
                ).format(remain, int(remain*8/1024/1024), remain/1024/1024))
-        total = platform.spiflash_total_size
+        total = spiflash_total_size
         print(("           Total space {:10} bytes"
                " ({} Megabits, {:.2f} Megabytes)"
                ).format(total, int(total*8/1024/1024), total/1024/1024))
 
         if args.force_image_size:
-            f.write(b'\xff' * (flash_size - f.tell()))
+            fill_bytes(f, flash_size)
+
+    write_manifest(output_file, [
+        (region_gw, gateware, gateware_len, gateware_sha),
+        (region_bios, bios, bios_len, bios_sha),
+        (region_fw, firmware, firmware_len, firmware_sha),
+    ])
 
     print()
     print("Flash image: {}".format(output_file))
-    flash_image_data = open(output_file, "rb").read()
-    print(" ".join("{:02x}".format(i) for i in flash_image_data[:64]))
+    print("   Manifest: {}".format(get_manifest_file(output_file)))
+    with open(output_file, "rb") as f:
+        print(hexdump_head(f.read(64)))
+
+    startup_profile.report(args, "mkimage.py")
 
 
 if __name__ == "__main__":
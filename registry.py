@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Index of the available platforms and targets.
+
+The index is built by looking at the source files (not importing them), so
+listing what exists doesn't need migen / LiteX. It is cached in
+build/registry.json and only rebuilt when the modification time of one of
+the platforms/ or targets/ directories (or files in them) changes.
+
+The modules themselves are only imported when asked for, by
+load_platform() and load_soc().
+"""
+
+import argparse
+import importlib
+import json
+import os
+import re
+
+
+TOP_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_FILE = os.path.join(TOP_DIR, "build", "registry.json")
+
+# Things in targets/ which are not platforms.
+NOT_PLATFORMS = ("common", "__pycache__")
+
+_PLATFORM_RE = re.compile(r"^class Platform\b|['\"]Platform['\"]", re.MULTILINE)
+_SOC_RE = re.compile(r"^SoC\s*=", re.MULTILINE)
+
+
+def _py_files(path):
+    return sorted(
+        fn for fn in os.listdir(path)
+        if fn.endswith(".py") and not fn.startswith("__"))
+
+
+def _get_stamp():
+    """Modification times of everything the index depends on."""
+    stamp = {}
+    for d in ("platforms", "targets"):
+        path = os.path.join(TOP_DIR, d)
+        stamp[d] = os.stat(path).st_mtime
+    for p in sorted(os.listdir(os.path.join(TOP_DIR, "targets"))):
+        path = os.path.join(TOP_DIR, "targets", p)
+        if os.path.isdir(path):
+            stamp[os.path.join("targets", p)] = os.stat(path).st_mtime
+            for fn in _py_files(path):
+                stamp[os.path.join("targets", p, fn)] = os.stat(os.path.join(path, fn)).st_mtime
+    for fn in _py_files(os.path.join(TOP_DIR, "platforms")):
+        stamp[os.path.join("platforms", fn)] = os.stat(os.path.join(TOP_DIR, "platforms", fn)).st_mtime
+    return stamp
+
+
+def _contains(filename, regex):
+    with open(filename, encoding="utf-8", errors="replace") as f:
+        return regex.search(f.read()) is not None
+
+
+def _build_index():
+    index = {}
+    targets_dir = os.path.join(TOP_DIR, "targets")
+    for p in sorted(os.listdir(targets_dir)):
+        path = os.path.join(targets_dir, p)
+        if p in NOT_PLATFORMS or not os.path.isdir(path):
+            continue
+        module = os.path.join(TOP_DIR, "platforms", p + ".py")
+        targets = [
+            fn[:-3] for fn in _py_files(path)
+            if _contains(os.path.join(path, fn), _SOC_RE)]
+        index[p] = {
+            "module": os.path.exists(module) and _contains(module, _PLATFORM_RE),
+            "targets": targets,
+        }
+    return index
+
+
+_index = None
+def get_index():
+    global _index
+    if _index is not None:
+        return _index
+
+    stamp = _get_stamp()
+    try:
+        with open(CACHE_FILE) as f:
+            cache = json.load(f)
+        if cache["stamp"] == stamp:
+            _index = cache["index"]
+            return _index
+    except (OSError, ValueError, KeyError):
+        pass
+
+    _index = _build_index()
+    try:
+        os.makedirs(os.path.dirname(CACHE_FILE), exist_ok=True)
+        tmp = "{}.{}".format(CACHE_FILE, os.getpid())
+        with open(tmp, "w") as f:
+            json.dump({"stamp": stamp, "index": _index}, f, indent=1, sort_keys=True)
+        os.rename(tmp, CACHE_FILE)
+    except OSError:
+        # A read only checkout just doesn't get a cache.
+        pass
+    return _index
+
+
+def get_platforms():
+    return sorted(get_index().keys())
+
+
+def get_targets(platform):
+    assert platform in get_index(), (
+        "Unknown platform {!r}, valid platforms are: {}".format(
+            platform, " ".join(get_platforms())))
+    return get_index()[platform]["targets"]
+
+
+def load_platform(platform):
+    """Import and return the Platform class for a platform."""
+    assert platform in get_index() and get_index()[platform]["module"], (
+        "Unknown platform {!r}, valid platforms are: {}".format(
+            platform, " ".join(get_platforms())))
+    return importlib.import_module("platforms.{}".format(platform)).Platform
+
+
+def load_soc(platform, target):
+    """Import and return the SoC class for a platform's target."""
+    assert target in get_targets(platform), (
+        "Unknown target {!r} for {}, valid targets are: {}".format(
+            target, platform, " ".join(get_targets(platform))))
+    return importlib.import_module("targets.{}.{}".format(platform, target)).SoC
+
+
+def makefile():
+    """Contents for build/cache.mk"""
+    lines = [
+        "# List of avaliable platforms",
+        "PLATFORMS = {}".format(" ".join(get_platforms())),
+    ]
+    for p in get_platforms():
+        lines.append("# List of avaliable targets for {}".format(p))
+        lines.append("TARGETS_{} = {}".format(p, " ".join(get_targets(p))))
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--makefile", action="store_true", help="output build/cache.mk contents")
+    parser.add_argument("platform", nargs="?", help="list the targets for a platform")
+    args = parser.parse_args()
+
+    if args.makefile:
+        print(makefile(), end="")
+    elif args.platform:
+        print(" ".join(get_targets(args.platform)))
+    else:
+        print(" ".join(get_platforms()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Timing of the startup phases of make.py, flash.py and mkimage.py.
+
+Import this module *first* so the time spent importing everything else
+(migen, LiteX, ...) can be measured. The other phases are recorded with;
+
+    with startup_profile.phase("soc"):
+        soc = ...
+
+and reported when the tool is run with --profile-startup.
+"""
+
+import json
+import sys
+import time
+from contextlib import contextmanager
+
+
+_start = time.time()
+_imports_done = None
+_phases = []
+# Time spent in nested phases, for each phase being timed
+_nested = []
+
+
+def imports_done():
+    """Mark the end of the import phase (call at the start of main())."""
+    global _imports_done
+    if _imports_done is None:
+        _imports_done = time.time()
+
+
+@contextmanager
+def phase(name):
+    """
+    Time a phase. Time spent in phases nested inside it is only counted
+    for those, not for this one too.
+
+    >>> _phases[:] = []
+    >>> with phase("build"):
+    ...     with phase("soc"):
+    ...         time.sleep(0.2)
+    >>> [(name, round(t, 1)) for name, t in _phases]
+    [('soc', 0.2), ('build', 0.0)]
+    """
+    imports_done()
+    start = time.time()
+    _nested.append(0)
+    try:
+        yield
+    finally:
+        elapsed = time.time() - start
+        nested = _nested.pop()
+        if _nested:
+            _nested[-1] += elapsed
+        _phases.append((name, elapsed - nested))
+
+
+def get_report(tool):
+    """
+    >>> _phases[:] = [("platform", 0.25), ("soc", 2.0), ("platform", 0.25)]
+    >>> r = get_report("flash.py")
+    >>> r["tool"], r["phases"]["platform"], r["phases"]["soc"]
+    ('flash.py', 0.5, 2.0)
+    """
+    imports_done()
+    phases = {"imports": _imports_done - _start}
+    for name, t in _phases:
+        phases[name] = phases.get(name, 0) + t
+    return {
+        "tool": tool,
+        "phases": phases,
+        "total": time.time() - _start,
+    }
+
+
+def report(args, tool):
+    """Print the report and save it if --profile-startup was given."""
+    filename = getattr(args, "profile_startup", None)
+    if not filename:
+        return
+    r = get_report(tool)
+
+    print(file=sys.stderr)
+    print("Startup profile for {}".format(tool), file=sys.stderr)
+    print("-"*40, file=sys.stderr)
+    for name, t in r["phases"].items():
+        print("{:>20s}: {:8.3f}s".format(name, t), file=sys.stderr)
+    print("{:>20s}: {:8.3f}s".format("total", r["total"]), file=sys.stderr)
+    print("-"*40, file=sys.stderr)
+
+    if filename == "-":
+        # stdout is the tool's own output
+        json.dump(r, sys.stderr, indent=2)
+        print(file=sys.stderr)
+    else:
+        with open(filename, "w") as f:
+            json.dump(r, f, indent=2)
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Place and route sweep for timing closure.
+
+Runs several place and route passes (different seeds / strategies) in
+parallel from a single checkpoint created with `make.py --checkpoint`. As
+soon as one run meets timing the others are stopped and its bitstream is
+copied into the gateware directory. The slack of every run is recorded in
+sweep/results.json.
+"""
+
+import argparse
+import json
+import os
+import re
+import shutil
+import signal
+import subprocess
+import time
+
+import checkpoint
+import make
+
+
+# Placer directives tried (in order) for Vivado, which has no seed.
+VIVADO_DIRECTIVES = [
+    "Explore",
+    "ExtraNetDelay_high",
+    "ExtraPostPlacementOpt",
+    "WLDrivenBlockPlacement",
+    "AltSpreadLogic_high",
+    "SpreadLogic_high",
+    "EarlyBlockPlacement",
+    "ExtraTimingOpt",
+]
+
+
+def get_switches(toolchain, n):
+    """
+    The toolchain switches used for the n'th run of the sweep.
+
+    >>> get_switches("XilinxISEToolchain", 0)
+    [('par', '-t 1')]
+    >>> get_switches("XilinxVivadoToolchain", 1)
+    [('place_design', '-directive ExtraNetDelay_high')]
+    >>> get_switches("IceStormToolchain", 2)
+    [('nextpnr-ice40', '--seed 3')]
+    """
+    if toolchain == "XilinxISEToolchain":
+        # PAR cost table, valid values are 1-100
+        return [("par", "-t {}".format(n % 100 + 1))]
+    elif toolchain == "XilinxVivadoToolchain":
+        directive = VIVADO_DIRECTIVES[n % len(VIVADO_DIRECTIVES)]
+        return [("place_design", "-directive {}".format(directive))]
+    elif toolchain == "IceStormToolchain":
+        return [("nextpnr-ice40", "--seed {}".format(n + 1))]
+    elif toolchain == "LatticeTrellisToolchain":
+        return [("nextpnr-ecp5", "--seed {}".format(n + 1))]
+    else:
+        raise ValueError("Don't know how to sweep {}".format(toolchain))
+
+
+def parse_ise_timing(par_report):
+    """
+    Returns (timing met, timing score in ps).
+
+    >>> parse_ise_timing("Timing Score: 0 (Setup: 0, Hold: 0)\\nAll constraints were met.")
+    (True, 0)
+    >>> parse_ise_timing("Timing Score: 1234 (Setup: 1234, Hold: 0)")
+    (False, 1234)
+    """
+    m = re.search(r"Timing Score: (\d+)", par_report)
+    if not m:
+        return None, None
+    score = int(m.group(1))
+    return score == 0, score
+
+
+def parse_vivado_timing(timing_report):
+    """
+    Returns (timing met, worst negative slack in ns).
+
+    >>> report = '''
+    ... | Design Timing Summary
+    ... | ---------------------
+    ...     WNS(ns)      TNS(ns)  TNS Failing Endpoints
+    ...     -------      -------  ---------------------
+    ...      -0.125       -1.500                     12
+    ... '''
+    >>> parse_vivado_timing(report)
+    (False, -0.125)
+    """
+    lines = timing_report.splitlines()
+    for i, line in enumerate(lines):
+        if line.split()[:1] == ["WNS(ns)"] and i + 2 < len(lines):
+            wns = float(lines[i+2].split()[0])
+            return wns >= 0, wns
+    return None, None
+
+
+def parse_nextpnr_timing(log):
+    """
+    Returns (timing met, worst slack in ns).
+
+    >>> parse_nextpnr_timing('''
+    ... Info: Max frequency for clock 'sys_clk': 52.00 MHz (PASS at 50.00 MHz)
+    ... Info: Max frequency for clock 'usb_clk': 40.00 MHz (FAIL at 50.00 MHz)
+    ... ''')
+    (False, -5.0)
+    """
+    slacks = []
+    for achieved, target in re.findall(
+            r"Max frequency for clock '[^']*': ([\d.]+) MHz \((?:PASS|FAIL) at ([\d.]+) MHz\)", log):
+        slacks.append(1000/float(target) - 1000/float(achieved))
+    if not slacks:
+        return None, None
+    slack = round(min(slacks), 3)
+    return slack >= 0, slack
+
+
+def _read(filename):
+    if not os.path.exists(filename):
+        return ""
+    with open(filename, errors="replace") as f:
+        return f.read()
+
+
+def get_timing(toolchain, output_dir, logfile):
+    if toolchain == "XilinxISEToolchain":
+        return parse_ise_timing(_read(os.path.join(output_dir, "top.par")))
+    elif toolchain == "XilinxVivadoToolchain":
+        return parse_vivado_timing(_read(os.path.join(output_dir, "top_timing.rpt")))
+    else:
+        return parse_nextpnr_timing(_read(logfile))
+
+
+class Run:
+    def __init__(self, n, output_dir, switches):
+        self.n = n
+        self.output_dir = output_dir
+        self.switches = switches
+        self.logfile = os.path.join(output_dir, "sweep.log")
+        self.process = None
+        self.start = None
+        self.result = None
+
+    def launch(self, checkpoint_dir, overrides):
+        checkpoint.prepare(checkpoint_dir, self.output_dir, overrides, self.switches)
+        self.log = open(self.logfile, "w")
+        self.start = time.time()
+        self.process = subprocess.Popen(
+            ["bash", checkpoint.CHECKPOINT_SCRIPT], cwd=self.output_dir,
+            stdout=self.log, stderr=subprocess.STDOUT, start_new_session=True)
+
+    def stop(self):
+        if self.process.poll() is None:
+            os.killpg(self.process.pid, signal.SIGTERM)
+            self.process.wait()
+
+
+def sweep(pending, jobs, toolchain, checkpoint_dir, overrides, keep_going=False, interval=1):
+    """
+    Launch the runs (jobs at once) until one meets timing, returns the
+    results of all the runs and the winning run (or None).
+
+    >>> import contextlib, io, sys, tempfile
+    >>> class FakeRun(Run):
+    ...     # nextpnr stand in, run 0 meets timing first
+    ...     def launch(self, checkpoint_dir, overrides):
+    ...         os.makedirs(self.output_dir)
+    ...         self.log = open(self.logfile, "w")
+    ...         self.start = time.time()
+    ...         script = "import time; time.sleep({}); print(\\"Info: Max frequency for clock 'sys_clk': 52.00 MHz (PASS at 50.00 MHz)\\")"
+    ...         self.process = subprocess.Popen(
+    ...             [sys.executable, "-c", script.format(0 if self.n == 0 else 30)],
+    ...             stdout=self.log, start_new_session=True)
+    >>> d = tempfile.mkdtemp()
+    >>> runs = [FakeRun(n, os.path.join(d, str(n)), []) for n in range(3)]
+    >>> with contextlib.redirect_stdout(io.StringIO()):
+    ...     results, winner = sweep(runs, 3, "IceStormToolchain", d, {}, interval=0.1)
+    >>> winner.n
+    0
+    >>> [(r["run"], r["timing_met"], r["slack"]) for r in results]
+    [(0, True, 0.769), (1, None, None), (2, None, None)]
+    >>> all(r.process.poll() is not None for r in runs)
+    True
+    >>> shutil.rmtree(d)
+    """
+    running = []
+    finished = []
+    winner = None
+    while (pending and winner is None) or running:
+        while pending and len(running) < jobs and winner is None:
+            run = pending.pop(0)
+            run.launch(checkpoint_dir, overrides)
+            running.append(run)
+            print("Started run {} ({})".format(run.n, " ".join(" ".join(s) for s in run.switches)))
+
+        time.sleep(interval)
+        for run in list(running):
+            if run.process.poll() is None:
+                continue
+            running.remove(run)
+            run.log.close()
+            met, slack = get_timing(toolchain, run.output_dir, run.logfile)
+            run.result = {
+                "run": run.n,
+                "switches": [" ".join(s) for s in run.switches],
+                "returncode": run.process.returncode,
+                "time": time.time() - run.start,
+                "timing_met": met,
+                "slack": slack,
+            }
+            finished.append(run.result)
+            print("Finished run {} - returncode {}, timing met: {}, slack: {} ({:.0f}s)".format(
+                run.n, run.process.returncode, met, slack, run.result["time"]))
+
+            if winner is None and met and run.process.returncode == 0:
+                winner = run
+                if not keep_going:
+                    for other in running:
+                        other.stop()
+                        other.log.close()
+                        finished.append({
+                            "run": other.n,
+                            "switches": [" ".join(s) for s in other.switches],
+                            "returncode": None,
+                            "time": time.time() - other.start,
+                            "timing_met": None,
+                            "slack": None,
+                        })
+                    # The others were stopped, not finished
+                    running = []
+                    break
+
+    return sorted(finished, key=lambda r: r["run"]), winner
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    make.get_args(parser)
+    parser.add_argument("--checkpoint-dir", default=None,
+                        help="checkpoint to use (default: the build directory's)")
+    parser.add_argument("--runs", type=int, default=4,
+                        help="number of place and route runs")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="runs at once (default: all of them)")
+    parser.add_argument("--keep-going", action="store_true",
+                        help="don't stop the other runs when one meets timing")
+    args = parser.parse_args()
+
+    builddir = make.get_builddir(args)
+    checkpoint_dir = args.checkpoint_dir or make.get_checkpointdir(args)
+    assert os.path.exists(os.path.join(checkpoint_dir, checkpoint.CHECKPOINT_FILE)), (
+        "No checkpoint in {}, run make.py --checkpoint first.".format(checkpoint_dir))
+    metadata = checkpoint.read(checkpoint_dir)
+    toolchain = metadata["toolchain"]
+    overrides = dict(args.build_option)
+
+    sweep_dir = os.path.join(builddir, "sweep")
+    pending = []
+    for n in range(args.runs):
+        pending.append(Run(
+            n, os.path.join(sweep_dir, "run{:03d}".format(n)), get_switches(toolchain, n)))
+    jobs = args.jobs or args.runs
+
+    finished, winner = sweep(pending, jobs, toolchain, checkpoint_dir, overrides,
+                             keep_going=args.keep_going)
+
+    with open(os.path.join(sweep_dir, "results.json"), "w") as f:
+        json.dump(finished, f, indent=2)
+
+    if winner is None:
+        print("No run met timing, see {}".format(sweep_dir))
+        exit(1)
+
+    gateware_dir = os.path.join(builddir, "gateware")
+    os.makedirs(gateware_dir, exist_ok=True)
+    for ext in (".bit", ".bin"):
+        fn = os.path.join(winner.output_dir, "top" + ext)
+        if os.path.exists(fn):
+            shutil.copy2(fn, gateware_dir)
+    print("Run {} met timing, bitstream copied to {}".format(winner.n, gateware_dir))
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
+    main()
@@ -10,6 +10,7 @@ from litedram.phy import s7ddrphy
 
 from gateware import cas
 from gateware import info
+from gateware import memhash
 from gateware import spi_flash
 
 from targets.utils import period_ns, dict_set_max, define_flash_constants
@@ -21,7 +22,7 @@ class BaseSoC(SoCSDRAM):
         'spiflash': 0x20000000
     }}
 
-    def __init__(self, platform, spiflash="spiflash_1x", **kwargs):
+    def __init__(self, platform, spiflash="spiflash_1x", with_memhash=False, **kwargs):
         dict_set_max(kwargs, 'integrated_rom_size', 0x8000)
         dict_set_max(kwargs, 'integrated_sram_size', 0x8000)
 
@@ -90,6 +91,13 @@ class BaseSoC(SoCSDRAM):
             self.mem_map["spiflash"],
             platform.spiflash_total_size)
 
+        # Memory hash (verify DRAM / SPI flash contents from the host) -----------------------------
+        # (-Ot with_memhash 1, test/common.py memhash / cmphash)
+        if int(with_memhash):
+            self.submodules.memhash = memhash.MemoryHash(endianness=self.cpu.endianness)
+            self.add_wb_master(self.memhash.bus)
+            self.add_csr("memhash")
+
         bios_size = 0x8000
         self.flash_boot_address = self.mem_map["spiflash"]+platform.gateware_size+bios_size
         define_flash_constants(self)
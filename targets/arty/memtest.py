@@ -0,0 +1,27 @@
+from litedram.frontend.bist import LiteDRAMBISTGenerator, LiteDRAMBISTChecker
+
+from gateware.memtest import LiteDRAMBISTTimer
+
+from targets.arty.etherbone import SoC as BaseSoC
+
+
+class MemTestSoC(BaseSoC):
+    def __init__(self, platform, *args, **kwargs):
+        BaseSoC.__init__(self, platform, *args, **kwargs)
+
+        # DRAM BIST --------------------------------------------------------------------------------
+        # Used by test/test_memtest.py and test/test_ddr_calibration.py
+        self.submodules.generator = LiteDRAMBISTGenerator(
+            self.sdram.crossbar.get_port(mode="write"),
+        )
+        self.add_csr("generator")
+        self.submodules.checker = LiteDRAMBISTChecker(
+            self.sdram.crossbar.get_port(mode="read"),
+        )
+        self.add_csr("checker")
+        self.submodules.bist_timer = LiteDRAMBISTTimer(
+            self.generator, self.checker, self.clk_freq)
+        self.add_csr("bist_timer")
+
+
+SoC = MemTestSoC
@@ -2,7 +2,7 @@ from migen.fhdl.decorators import ClockDomainsRenamer
 from litex.soc.integration.soc_core import mem_decoder
 from litex.soc.interconnect import stream
 
-from gateware.encoder import EncoderDMAReader, EncoderBuffer, Encoder
+from gateware.encoder import EncoderDMAReader, EncoderBuffer, Encoder, EncoderStats, EncoderRateControl
 from gateware.streamer import USBStreamer
 
 from targets.atlys.video import SoC as BaseSoC
@@ -42,6 +42,11 @@ class HDMI2USBSoC(BaseSoC):
         self.add_wb_slave(self.mem_map["encoder"], encoder.bus)
         self.add_memory_region("encoder",
             self.mem_map["encoder"], 0x2000, type="io")
+        # See test/test_encoder_stats.py
+        self.submodules.encoder_stats = EncoderStats(encoder, self.encoder_reader)
+        self.add_csr("encoder_stats")
+        self.submodules.encoder_rate = EncoderRateControl(encoder, self.clk_freq)
+        self.add_csr("encoder_rate")
 
         self.platform.add_period_constraint(encoder_streamer.cd_usb.clk, 10.0)
 
@@ -16,6 +16,7 @@ from litedram.core import ControllerSettings
 #from gateware import cas
 from gateware import i2c
 from gateware import info
+from gateware import memhash
 from gateware import opsis_i2c
 from gateware import shared_uart
 from gateware import tofe
@@ -56,7 +57,7 @@ class BaseSoC(SoCSDRAM):
         'spiflash': 0x20000000,
     }}
 
-    def __init__(self, platform, **kwargs):
+    def __init__(self, platform, with_memhash=False, **kwargs):
         dict_set_max(kwargs, 'integrated_rom_size', 0x8000)
         dict_set_max(kwargs, 'integrated_sram_size', 0x8000)
 
@@ -155,6 +156,13 @@ class BaseSoC(SoCSDRAM):
             self.mem_map["spiflash"],
             platform.spiflash_total_size)
 
+        # Memory hash (verify DRAM / SPI flash contents from the host) -----------------------------
+        # (-Ot with_memhash 1, test/common.py memhash / cmphash)
+        if int(with_memhash):
+            self.submodules.memhash = memhash.MemoryHash(endianness=self.cpu.endianness)
+            self.add_wb_master(self.memhash.bus)
+            self.add_csr("memhash")
+
         bios_size = 0x8000
         self.flash_boot_address = self.mem_map["spiflash"]+platform.gateware_size+bios_size
         define_flash_constants(self)
@@ -2,7 +2,7 @@ from migen.fhdl.decorators import ClockDomainsRenamer
 from litex.soc.integration.soc_core import mem_decoder
 from litex.soc.interconnect import stream
 
-from gateware.encoder import EncoderDMAReader, EncoderBuffer, Encoder
+from gateware.encoder import EncoderPrefetchReader, EncoderMultiBuffer, Encoder, EncoderStats, EncoderRateControl
 from gateware.streamer import USBStreamer
 
 from targets.opsis.net import SoC as BaseSoC
@@ -17,15 +17,20 @@ class EncoderSoC(BaseSoC):
         BaseSoC.__init__(self, platform, *args, **kwargs)
 
         encoder_port = self.sdram.crossbar.get_port()
-        self.submodules.encoder_reader = EncoderDMAReader(encoder_port)
+        # Fetches whole 8 line strips, so 1080p keeps up when the HDMI
+        # in / out ports are busy.
+        self.submodules.encoder_reader = EncoderPrefetchReader(encoder_port)
         self.add_csr("encoder_reader")
         encoder_cdc = stream.AsyncFIFO([("data", 128)], 4)
         encoder_cdc = ClockDomainsRenamer({"write": "sys",
                                            "read": "encoder"})(encoder_cdc)
-        encoder_buffer = ClockDomainsRenamer("encoder")(EncoderBuffer())
+        # Absorbs DRAM latency spikes from the other crossbar ports, see
+        # encoder_buffer_high_water to size it.
+        self.submodules.encoder_buffer = encoder_buffer = EncoderMultiBuffer(nslots=16)
+        self.add_csr("encoder_buffer")
         encoder = Encoder(platform)
         encoder_streamer = USBStreamer(platform, platform.request("fx2"))
-        self.submodules += encoder_cdc, encoder_buffer, encoder, encoder_streamer
+        self.submodules += encoder_cdc, encoder, encoder_streamer
         self.add_csr("encoder")
 
         self.comb += [
@@ -37,6 +42,11 @@ class EncoderSoC(BaseSoC):
         self.add_wb_slave(self.mem_map["encoder"], encoder.bus)
         self.add_memory_region("encoder",
             self.mem_map["encoder"], 0x2000, type="io")
+        # See test/test_encoder_stats.py
+        self.submodules.encoder_stats = EncoderStats(encoder, self.encoder_reader)
+        self.add_csr("encoder_stats")
+        self.submodules.encoder_rate = EncoderRateControl(encoder, self.clk_freq)
+        self.add_csr("encoder_rate")
 
         self.platform.add_period_constraint(encoder_streamer.cd_usb.clk, 10.0)
 
@@ -1,5 +1,7 @@
 from litedram.frontend.bist import LiteDRAMBISTGenerator, LiteDRAMBISTChecker
 
+from gateware.memtest import LiteDRAMBISTTimer
+
 from targets.sim.net import NetSoC as BaseSoC
 
 
@@ -20,6 +22,9 @@ class MemTestSoC(BaseSoC):
         #   cd="hdmi_out1_pix"),
         )
         self.add_csr("checker")
+        self.submodules.bist_timer = LiteDRAMBISTTimer(
+            self.generator, self.checker, self.clk_freq)
+        self.add_csr("bist_timer")
 
 
 SoC = MemTestSoC
@@ -0,0 +1,167 @@
+"""
+asyncio client for the LiteX RemoteServer started by common.connect.
+
+The blocking RemoteClient waits for the reply to each read before doing
+anything else. AsyncRemoteClient speaks the same Etherbone over TCP
+protocol but with asyncio streams; requests are sent as soon as they are
+made and replies are matched to them in order, so many coroutines (memtest
+polling, XADC monitoring, analyzer uploads, ...) can share one connection.
+
+    args, wb, awb = connect_async("My test")
+    async def main():
+        await awb.open()
+        temp = await awb.regs.xadc_temperature.read()
+        data = await awb.bulk_read_words(awb.mems.main_ram.base, 1024)
+    asyncio.get_event_loop().run_until_complete(main())
+
+The register and memory maps are taken from the (blocking) RemoteClient
+which common.connect returns.
+"""
+
+import asyncio
+import collections
+import struct
+
+from common import connect, datas_to_reg, reg_to_datas, _bulk_chunks, BULK_RECORD_WORDS
+
+
+class AsyncRegister:
+    def __init__(self, client, reg):
+        self.client = client
+        self.reg = reg
+
+    async def read(self):
+        return datas_to_reg(self.reg, await self.client.read(self.reg.addr, self.reg.length))
+
+    async def write(self, value):
+        await self.client.write(self.reg.addr, reg_to_datas(self.reg, value))
+
+
+class AsyncRegisters:
+    def __init__(self, client, regs):
+        self._client = client
+        self._regs = regs
+        self._cache = {}
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if name not in self._cache:
+            self._cache[name] = AsyncRegister(self._client, getattr(self._regs, name))
+        return self._cache[name]
+
+
+class AsyncRemoteClient:
+    def __init__(self, wb):
+        self.host = wb.host
+        self.port = wb.port
+        self.base_address = wb.base_address
+        self.regs = AsyncRegisters(self, wb.regs)
+        self.mems = wb.mems
+        self.reader = None
+        self.writer = None
+        self.pending = collections.deque()
+        self.receiver = None
+
+    async def open(self):
+        if self.writer is not None:
+            return
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.receiver = asyncio.ensure_future(self._receive())
+
+    async def close(self):
+        if self.writer is None:
+            return
+        self.receiver.cancel()
+        self.writer.close()
+        self.writer = None
+        for future in self.pending:
+            if not future.done():
+                future.cancel()
+        self.pending.clear()
+
+    async def _receive_packet(self):
+        from litex.tools.remote.etherbone import (
+            etherbone_packet_header_length, etherbone_record_header_length)
+        header_length = etherbone_packet_header_length + etherbone_record_header_length
+        header = await self.reader.readexactly(header_length)
+        wcount, rcount = struct.unpack(">BB", header[-2:])
+        # Each of the write and read parts has a base address then the data.
+        body_length = 4*(wcount + (wcount != 0) + rcount + (rcount != 0))
+        return header + await self.reader.readexactly(body_length)
+
+    async def _receive(self):
+        from litex.tools.remote.etherbone import EtherbonePacket
+        try:
+            while True:
+                data = await self._receive_packet()
+                packet = EtherbonePacket(data)
+                packet.decode()
+                future = self.pending.popleft()
+                if not future.cancelled():
+                    future.set_result(packet.records.pop().writes.get_datas())
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            while self.pending:
+                future = self.pending.popleft()
+                if not future.done():
+                    future.set_exception(e)
+
+    def _send_read(self, addr, length):
+        from litex.tools.remote.etherbone import EtherbonePacket, EtherboneRecord, EtherboneReads
+        record = EtherboneRecord()
+        record.reads = EtherboneReads(addrs=[self.base_address + addr + 4*j for j in range(length)])
+        record.rcount = len(record.reads)
+        packet = EtherbonePacket()
+        packet.records = [record]
+        packet.encode()
+
+        future = asyncio.get_event_loop().create_future()
+        # Replies come back in the order the requests were sent.
+        self.pending.append(future)
+        self.writer.write(packet.bytes)
+        return future
+
+    async def read(self, addr, length=None):
+        assert length is None or length <= BULK_RECORD_WORDS, (
+            "Use bulk_read_words for more than {} words".format(BULK_RECORD_WORDS))
+        datas = await self._send_read(addr, 1 if length is None else length)
+        return datas[0] if length is None else datas
+
+    async def write(self, addr, datas):
+        from litex.tools.remote.etherbone import EtherbonePacket, EtherboneRecord, EtherboneWrites
+        datas = datas if isinstance(datas, list) else [datas]
+        record = EtherboneRecord()
+        record.writes = EtherboneWrites(base_addr=self.base_address + addr, datas=datas)
+        record.wcount = len(record.writes)
+        packet = EtherbonePacket()
+        packet.records = [record]
+        packet.encode()
+        # Writes have no reply, only wait for the data to be sent.
+        self.writer.write(packet.bytes)
+        await self.writer.drain()
+
+    async def bulk_read_words(self, addr, length):
+        """Read length 32bit words starting at addr, returns a list of ints."""
+        futures = [self._send_read(a, l) for a, l in _bulk_chunks(addr, length)]
+        words = []
+        for chunk in await asyncio.gather(*futures):
+            words += chunk
+        return words
+
+    async def bulk_write(self, addr, data):
+        """Write a list of 32bit ints, big endian bytes or numpy array starting at addr."""
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            assert len(data) % 4 == 0, len(data)
+            data = struct.unpack(">{}I".format(len(data)//4), data)
+        elif hasattr(data, "tolist"):
+            data = data.ravel().tolist()
+        data = list(data)
+        for n, (chunk_addr, chunk_len) in enumerate(_bulk_chunks(addr, len(data))):
+            start = n*BULK_RECORD_WORDS
+            await self.write(chunk_addr, data[start:start+chunk_len])
+
+
+def connect_async(desc, *args, **kw):
+    """Like common.connect, but also returns an AsyncRemoteClient."""
+    args, wb = connect(desc, *args, **kw)
+    return args, wb, AsyncRemoteClient(wb)
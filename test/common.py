@@ -1,6 +1,8 @@
 
 import argparse
+import json
 import os
+import socket
 import sys
 import threading
 
@@ -13,59 +15,89 @@ sys.path.append(TOP_DIR)
 from make import get_args, get_testdir
 
 
+def get_comm(args):
+    """The litex.tools.remote comm for the selected interface, None on error."""
+    if args.uart:
+        from litex.tools.remote.comm_uart import CommUART
+        if args.uart_port is None:
+            print("Need to specify --uart-port, exiting.")
+            return None
+        uart_port = args.uart_port
+        uart_baudrate = int(float(args.uart_baudrate))
+        print("[CommUART] port: {} / baudrate: {} / ".format(uart_port, uart_baudrate), end="")
+        comm = CommUART(uart_port, uart_baudrate)
+    elif args.udp:
+        from litex.tools.remote.comm_udp import CommUDP
+        udp_ip = args.udp_ip
+        udp_port = int(args.udp_port)
+        print("[CommUDP] ip: {} / port: {} / ".format(udp_ip, udp_port), end="")
+        comm = CommUDP(udp_ip, udp_port)
+    elif args.pcie:
+        from litex.tools.remote.comm_pcie import CommPCIe
+        pcie_bar = args.pcie_bar
+        if args.pcie_bar is None:
+            print("Need to speficy --pcie-bar, exiting.")
+            return None
+        print("[CommPCIe] bar: {} / ".format(args.pcie_bar), end="")
+        comm = CommPCIe(args.pcie_bar)
+    elif args.usb:
+        from litex.tools.remote.comm_usb import CommUSB
+        if args.usb_pid is None and args.usb_vid is None:
+            print("Need to speficy --usb-vid or --usb-pid, exiting.")
+            return None
+        print("[CommUSB] vid: {} / pid: {} / ".format(args.usb_vid, args.usb_pid), end="")
+        pid = args.usb_pid
+        if pid is not None:
+            pid = int(pid, base=0)
+        vid = args.usb_vid
+        if vid is not None:
+            vid = int(vid, base=0)
+        comm = CommUSB(vid=vid, pid=pid, max_retries=args.usb_max_retries)
+    else:
+        return None
+    return comm
+
+
 class ServerProxy(threading.Thread):
     daemon = True
 
     def __init__(self, args):
         threading.Thread.__init__(self)
         self.args = args
-        self.ready = False
+        self.server = None
+        self.ready = threading.Event()
 
     def run(self):
-        args = self.args
-        if args.uart:
-            from litex.tools.remote.comm_uart import CommUART
-            if args.uart_port is None:
-                print("Need to specify --uart-port, exiting.")
-                exit()
-            uart_port = args.uart_port
-            uart_baudrate = int(float(args.uart_baudrate))
-            print("[CommUART] port: {} / baudrate: {} / ".format(uart_port, uart_baudrate), end="")
-            comm = CommUART(uart_port, uart_baudrate)
-        elif args.udp:
-            from litex.tools.remote.comm_udp import CommUDP
-            udp_ip = args.udp_ip
-            udp_port = int(args.udp_port)
-            print("[CommUDP] ip: {} / port: {} / ".format(udp_ip, udp_port), end="")
-            comm = CommUDP(udp_ip, udp_port)
-        elif args.pcie:
-            from litex.tools.remote.comm_pcie import CommPCIe
-            pcie_bar = args.pcie_bar
-            if args.pcie_bar is None:
-                print("Need to speficy --pcie-bar, exiting.")
-                exit()
-            print("[CommPCIe] bar: {} / ".format(args.pcie_bar), end="")
-            comm = CommPCIe(args.pcie_bar)
-        elif args.usb:
-            from litex.tools.remote.comm_usb import CommUSB
-            if args.usb_pid is None and args.usb_vid is None:
-                print("Need to speficy --usb-vid or --usb-pid, exiting.")
-                exit()
-            print("[CommUSB] vid: {} / pid: {} / ".format(args.usb_vid, args.usb_pid), end="")
-            pid = args.usb_pid
-            if pid is not None:
-                pid = int(pid, base=0)
-            vid = args.usb_vid
-            if vid is not None:
-                vid = int(vid, base=0)
-            comm = CommUSB(vid=vid, pid=pid, max_retries=args.usb_max_retries)
-        else:
+        comm = get_comm(self.args)
+        if comm is None:
             exit()
 
-        self.server = RemoteServer(comm, args.bind_ip, int(args.bind_port))
+        self.server = RemoteServer(comm, self.args.bind_ip, int(self.args.bind_port))
         self.server.open()
         self.server.start(4)
-        self.ready = True
+        self.ready.set()
+
+
+def start_server(args):
+    """Start a RemoteServer for the board, returns None if it failed."""
+    s = ServerProxy(args)
+    s.start()
+    # The thread exits without setting ready if it couldn't open the
+    # connection to the board.
+    while not s.ready.wait(0.1):
+        if not s.is_alive():
+            return None
+    return s
+
+
+def stop_server(server):
+    """Close a RemoteServer (from start_server(args).server), freeing its port."""
+    try:
+        # Wakes up the serve threads blocked in accept(), they exit.
+        server.socket.shutdown(socket.SHUT_RDWR)
+    except (AttributeError, OSError):
+        pass
+    server.close()
 
 
 def connect(desc, *args, add_args=None, **kw):
@@ -114,17 +146,16 @@ def connect(desc, *args, add_args=None, **kw):
         add_args(parser)
     args = parser.parse_args()
 
-    s = ServerProxy(args)
-    s.start()
-    while not s.ready:
-        continue
+    if start_server(args) is None:
+        sys.exit(1)
 
     test_dir = os.path.join(TOP_DIR, get_testdir(args))
     wb = RemoteClient(args.bind_ip, int(args.bind_port), csr_csv="{}/csr.csv".format(test_dir), debug=True)
     wb.open()
+    dna, git = get_identity(wb)
     print()
-    print("Device DNA: {}".format(get_dna(wb)))
-    print("   Git Rev: {}".format(get_git(wb)))
+    print("Device DNA: {}".format(dna))
+    print("   Git Rev: {}".format(git))
     print("  Platform: {}".format(get_platform(wb)))
     print("  Analyzer: {}".format(["No", "Yes"][hasattr(wb.regs, "analyzer")]))
     print("      XADC: {}".format(get_xadc(wb)))
@@ -161,6 +192,67 @@ def get_git(wb):
         return 'Unknown'
 
 
+def get_identity(wb):
+    """
+    (DNA, git commit) of the board, read once per connection. Together they
+    identify the board and the gateware loaded on it, so they are the key
+    for anything cached per board.
+    """
+    if not hasattr(wb, "board_identity"):
+        wb.board_identity = (get_dna(wb), get_git(wb))
+    return wb.board_identity
+
+
+IDENTITY_CACHE = os.path.join(TOP_DIR, "build", "board-identity.json")
+# test/farm.py runs boards from a thread pool, the read / update / rename of
+# the cache must not interleave between them.
+_identity_cache_lock = threading.Lock()
+
+
+def _read_identity_cache():
+    try:
+        with open(IDENTITY_CACHE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_identity_cache(cache):
+    try:
+        os.makedirs(os.path.dirname(IDENTITY_CACHE), exist_ok=True)
+        tmp = "{}.{}.{}".format(IDENTITY_CACHE, os.getpid(), threading.get_ident())
+        with open(tmp, "w") as f:
+            json.dump(cache, f, indent=1, sort_keys=True)
+        os.rename(tmp, IDENTITY_CACHE)
+    except OSError:
+        pass
+
+
+def read_static(wb, name):
+    """
+    Read a register which can't change without the gateware changing
+    (info_platform_*, ...). Values are cached in build/board-identity.json
+    per board identity.
+    """
+    reg = getattr(wb.regs, name)
+    identity = get_identity(wb)
+    if 'Unknown' in identity:
+        return reg.read()
+
+    key = "-".join(identity)
+    board = _read_identity_cache().get(key, {})
+    if name in board:
+        return board[name]
+
+    # Read the board outside the lock, the others shouldn't wait on it.
+    value = reg.read()
+    with _identity_cache_lock:
+        cache = _read_identity_cache()
+        cache.setdefault(key, {})[name] = value
+        _write_identity_cache(cache)
+    return value
+
+
 # xadc stuff
 def xadc2volts(v):
     return (v/4096.0*3)
@@ -180,8 +272,9 @@ def get_xadc(wb):
         return 'Unknown'
 
 
-def stringify(reg):
-    d = reg.read()
+def stringify(reg, d=None):
+    if d is None:
+        d = reg.read()
     chars = []
     for i in range(0, reg.length):
         b = (d >> (8 * i)) & 0xff
@@ -193,13 +286,44 @@ def stringify(reg):
 
 def get_platform(wb):
     try:
-        target = stringify(wb.regs.info_platform_target)
-        platform = stringify(wb.regs.info_platform_platform)
+        target = stringify(
+            wb.regs.info_platform_target, read_static(wb, "info_platform_target"))
+        platform = stringify(
+            wb.regs.info_platform_platform, read_static(wb, "info_platform_platform"))
         return "{} on {}".format(target, platform)
     except (KeyError, AttributeError) as e:
         return 'Unknown on Unknown'
 
 
+def reg_to_datas(reg, value):
+    """
+    Split a register value into the CSR bus words to write, like
+    CSRRegister.write does.
+
+    >>> from collections import namedtuple
+    >>> Reg = namedtuple("Reg", "addr length data_width")
+    >>> reg_to_datas(Reg(0, 2, 8), 1280)
+    [5, 0]
+    """
+    data_width = getattr(reg, "data_width", getattr(reg, "busword", 8))
+    mask = 2**data_width - 1
+    return [(value >> ((reg.length-1-i)*data_width)) & mask for i in range(reg.length)]
+
+
+def datas_to_reg(reg, datas):
+    """
+    >>> from collections import namedtuple
+    >>> Reg = namedtuple("Reg", "addr length data_width")
+    >>> datas_to_reg(Reg(0, 2, 8), [5, 0])
+    1280
+    """
+    data_width = getattr(reg, "data_width", getattr(reg, "busword", 8))
+    value = 0
+    for d in datas:
+        value = (value << data_width) | d
+    return value
+
+
 def write_and_check(reg, value):
     reg.write(value)
     r = reg.read()
@@ -207,36 +331,208 @@ def write_and_check(reg, value):
 
 
 def memdump(wb, start, length):
-    data = wb.read(start, length)
-    for i, d in enumerate(data):
-        address = i*4 + start
+    data = bulk_read(wb, start, length)
+    for i in range(0, len(data), 4):
+        address = i + start
         if address % 32 == 0:
             print()
             print("0x{:04x} ".format(address), sep=' ', end='')
-        for b in struct.pack('>I', d):
+        for b in data[i:i+4]:
             print("{:02x}".format(b), end=' ')
 
 
 import struct
 
-BLOCK_SIZE=64
-def cmpflash(wb, start, filename, skip=0, max=1024):
+# Bulk memory transfers
+# ---------------------
+# An Etherbone record holds at most 255 reads / writes (8 bit counts), so
+# large transfers are split into records of this many words. Read requests
+# are pipelined; up to BULK_INFLIGHT of them are sent to litex_server before
+# waiting for the first reply. The server still forwards them to the board
+# one at a time, so only the host <-> server part of each round trip is
+# hidden, the link to the board (UART, UDP, ...) is not. test_bulk.py
+# measures what that is worth on a given setup.
+BULK_RECORD_WORDS = 255
+BULK_INFLIGHT = 8
+
+
+def _bulk_chunks(addr, length, words=BULK_RECORD_WORDS):
+    """
+    >>> list(_bulk_chunks(0x100, 600))
+    [(256, 255), (1276, 255), (2296, 90)]
+    """
+    for n in range(0, length, words):
+        yield addr + n*4, min(words, length - n)
+
+
+def _send_read(wb, addr, length):
+    from litex.tools.remote.etherbone import EtherbonePacket, EtherboneRecord, EtherboneReads
+    record = EtherboneRecord()
+    record.reads = EtherboneReads(addrs=[wb.base_address + addr + 4*j for j in range(length)])
+    record.rcount = len(record.reads)
+    packet = EtherbonePacket()
+    packet.records = [record]
+    packet.encode()
+    wb.send_packet(wb.socket, packet)
+
+
+def _receive_read(wb):
+    from litex.tools.remote.etherbone import EtherbonePacket
+    packet = EtherbonePacket(wb.receive_packet(wb.socket))
+    packet.decode()
+    return packet.records.pop().writes.get_datas()
+
+
+def bulk_read_words(wb, addr, length, inflight=BULK_INFLIGHT):
+    """Read length 32bit words starting at addr, returns a list of ints."""
+    chunks = list(_bulk_chunks(addr, length))
+    if not hasattr(wb, "send_packet"):
+        # Not a RemoteClient, fall back to one request at a time.
+        words = []
+        for chunk_addr, chunk_len in chunks:
+            words += wb.read(chunk_addr, chunk_len)
+        return words
+
+    words = []
+    sent = 0
+    while sent < min(inflight, len(chunks)):
+        _send_read(wb, *chunks[sent])
+        sent += 1
+    for _ in chunks:
+        words += _receive_read(wb)
+        if sent < len(chunks):
+            _send_read(wb, *chunks[sent])
+            sent += 1
+    return words
+
+
+def bulk_read(wb, addr, length, inflight=BULK_INFLIGHT):
+    """Read length 32bit words starting at addr, returns big endian bytes."""
+    words = bulk_read_words(wb, addr, length, inflight)
+    return struct.pack(">{}I".format(len(words)), *words)
+
+
+def bulk_read_array(wb, addr, length, inflight=BULK_INFLIGHT):
+    """Read length 32bit words starting at addr, returns a numpy uint32 array."""
+    import numpy
+    return numpy.array(bulk_read_words(wb, addr, length, inflight), dtype=numpy.uint32)
+
+
+def bulk_write(wb, addr, data):
+    """
+    Write data starting at addr. data can be a list of 32bit ints, big
+    endian bytes or a numpy array.
+
+    Etherbone writes have no reply, so these are naturally pipelined.
+    """
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        assert len(data) % 4 == 0, len(data)
+        data = struct.unpack(">{}I".format(len(data)//4), data)
+    elif hasattr(data, "tolist"):
+        # numpy array, tolist() converts to Python ints in one go.
+        data = data.ravel().tolist()
+    data = list(data)
+    for n, (chunk_addr, chunk_len) in enumerate(_bulk_chunks(addr, len(data))):
+        start = n*BULK_RECORD_WORDS
+        wb.write(chunk_addr, data[start:start+chunk_len])
+
+def mismatch_ranges(expected, actual, base=0, gap=0):
+    """
+    Compare two equal length numpy byte arrays, returns the (start, end)
+    address ranges which differ. Ranges less than gap bytes apart are
+    merged.
+
+    >>> import numpy
+    >>> a = numpy.frombuffer(b"abcdefghij", numpy.uint8)
+    >>> b = numpy.frombuffer(b"abXYefgZiZ", numpy.uint8)
+    >>> mismatch_ranges(a, b, 0x100)
+    [(258, 260), (263, 264), (265, 266)]
+    >>> mismatch_ranges(a, b, 0x100, gap=1)
+    [(258, 260), (263, 266)]
+    >>> mismatch_ranges(a, a)
+    []
+    """
+    import numpy
+    diff = numpy.flatnonzero(expected != actual)
+    if not len(diff):
+        return []
+    breaks = numpy.flatnonzero(numpy.diff(diff) > gap + 1)
+    starts = numpy.concatenate((diff[:1], diff[breaks+1]))
+    ends = numpy.concatenate((diff[breaks], diff[-1:])) + 1
+    return [(base + int(s), base + int(e)) for s, e in zip(starts, ends)]
+
+
+def cmpflash(wb, start, filename, skip=0, max=1024, gap=0):
+    """
+    Compare max bytes of filename (from skip, all of it if max is None)
+    with the memory at start + skip, returns the mismatching address
+    ranges.
+    """
+    import numpy
     assert skip%4==0
     with open(filename, 'rb') as f:
-        local_data=f.read()[:skip+max]
-    j = skip
-    while j < len(local_data):
-        mem_data_len = min(BLOCK_SIZE, len(local_data)-j)
-        mem_data = b"".join(struct.pack('>I', k) for k in wb.read(start+j, mem_data_len))
-        for i in range(0, mem_data_len):
-            addr, expected, actual = j+i+start, local_data[j+i], mem_data[i]
-            if addr % 8 == 0:
-                print()
-                print("0x{:08x} ".format(addr), sep=' ', end='')
-            if expected != actual:
-                print()
-                print("{:08x} {:02x} != {:02x}".format(addr, expected, actual))
-            else:
-                print(".", end="", flush=True)
-        j += BLOCK_SIZE
-
+        f.seek(skip)
+        local_data = f.read() if max is None else f.read(max)
+    length = len(local_data)
+    addr = start+skip
+
+    mem_data = bulk_read(wb, addr, (length+3)//4)[:length]
+    expected = numpy.frombuffer(local_data, numpy.uint8)
+    actual = numpy.frombuffer(mem_data, numpy.uint8)
+    mismatches = mismatch_ranges(expected, actual, addr, gap)
+
+    print("Compared {} bytes at 0x{:08x}: {} mismatching range(s)".format(
+        length, addr, len(mismatches)))
+    for range_start, range_end in mismatches:
+        i, j = range_start-addr, min(range_end-addr, range_start-addr+16)
+        print("0x{:08x}-0x{:08x} ({:8} bytes) expected {} got {}{}".format(
+            range_start, range_end, range_end-range_start,
+            local_data[i:j].hex(), mem_data[i:j].hex(),
+            "..." if range_end-range_start > 16 else ""))
+    return mismatches
+
+
+def memhash(wb, addr, length, timeout=30):
+    """
+    CRC32 (as zlib.crc32) of length bytes at addr, computed on the board by
+    the memhash core (targets built with -Ot with_memhash 1). length is
+    rounded down to a multiple of 4.
+    """
+    import time
+    wb.regs.memhash_base.write(addr)
+    wb.regs.memhash_length.write(length & ~3)
+    wb.regs.memhash_start.write(1)
+    deadline = time.time() + timeout
+    while not wb.regs.memhash_done.read():
+        assert time.time() < deadline, "memhash didn't finish in {}s".format(timeout)
+        time.sleep(0.01)
+    assert not wb.regs.memhash_error.read(), (
+        "memhash: bus error / timeout reading 0x{:08x}-0x{:08x}".format(addr, addr + length))
+    return wb.regs.memhash_result.read()
+
+
+def cmphash(wb, start, filename, skip=0, max=None):
+    """
+    Compare filename (from skip, max bytes) with the memory at start + skip
+    using the memhash core, so only the CRC (and up to 3 trailing bytes)
+    are read over the link. Returns True if they match.
+    """
+    import zlib
+    assert skip%4==0
+    with open(filename, 'rb') as f:
+        f.seek(skip)
+        local_data = f.read() if max is None else f.read(max)
+    addr = start+skip
+    aligned = len(local_data) & ~3
+
+    expected = zlib.crc32(local_data[:aligned]) & 0xffffffff
+    actual = memhash(wb, addr, aligned)
+    ok = expected == actual
+
+    tail = local_data[aligned:]
+    if tail:
+        ok = ok and bulk_read(wb, addr+aligned, 1)[:len(tail)] == tail
+
+    print("{} bytes at 0x{:08x}: crc32 expected 0x{:08x} got 0x{:08x} - {}".format(
+        len(local_data), addr, expected, actual, "OK" if ok else "MISMATCH"))
+    return ok
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Run a test across a farm of boards in parallel.
+
+The boards are listed in a file, one per line;
+
+    # name      interface   address             [csr.csv]
+    opsis-01    udp         192.168.100.51
+    opsis-02    udp         192.168.100.52:1235
+    arty-01     uart        /dev/ttyUSB1@115200  build/arty_net_vexriscv/test/csr.csv
+    opsis-03    usb         0x2a19:0x5442
+    kc705-01    pcie        /sys/bus/pci/devices/0000:01:00.0/resource0
+
+Each board gets its own RemoteServer (on --bind-port, --bind-port + 1, ...)
+and connection, which are kept open between runs. Boards are identified by
+DNA / git commit / platform, with the static parts cached per board (see
+common.read_static) so reconnecting is cheap.
+
+The test is a function taking the RemoteClient for a board and returning
+something which can be saved as json, given as `module:function`;
+
+    ./test/farm.py --boards boards.txt --test test_mymodule:check_leds
+"""
+
+import argparse
+import concurrent.futures
+import importlib
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+
+from common import *
+
+
+def parse_board(line, bind_ip="localhost", bind_port=1234):
+    """
+    >>> b = parse_board("opsis-01 udp 192.168.100.51:1235")
+    >>> b.name, b.udp, b.udp_ip, b.udp_port, b.uart, b.csr_csv
+    ('opsis-01', True, '192.168.100.51', 1235, False, None)
+    >>> b = parse_board("arty uart /dev/ttyUSB1@115200 arty/csr.csv", bind_port=1240)
+    >>> b.uart_port, b.uart_baudrate, b.csr_csv, b.bind_port
+    ('/dev/ttyUSB1', '115200', 'arty/csr.csv', 1240)
+    >>> b = parse_board("opsis usb 0x2a19:")
+    >>> b.usb_vid, b.usb_pid
+    ('0x2a19', None)
+    """
+    parts = line.split()
+    assert len(parts) in (3, 4), "Expected 'name interface address [csr.csv]', got {!r}".format(line)
+    name, interface, address = parts[:3]
+    assert interface in ("udp", "uart", "pcie", "usb"), "Unknown interface {!r}".format(interface)
+
+    args = argparse.Namespace(
+        name=name,
+        csr_csv=parts[3] if len(parts) > 3 else None,
+        bind_ip=bind_ip, bind_port=bind_port,
+        uart=False, uart_port=None, uart_baudrate=115200,
+        udp=False, udp_ip=None, udp_port=1234,
+        pcie=False, pcie_bar=None,
+        usb=False, usb_vid=None, usb_pid=None, usb_max_retries=10,
+    )
+    setattr(args, interface, True)
+    if interface == "udp":
+        args.udp_ip, _, port = address.partition(":")
+        if port:
+            args.udp_port = int(port)
+    elif interface == "uart":
+        args.uart_port, _, baudrate = address.partition("@")
+        if baudrate:
+            args.uart_baudrate = baudrate
+    elif interface == "pcie":
+        args.pcie_bar = address
+    elif interface == "usb":
+        vid, _, pid = address.partition(":")
+        args.usb_vid = vid or None
+        args.usb_pid = pid or None
+    return args
+
+
+def read_boards(filename, bind_ip="localhost", bind_port=1234):
+    boards = []
+    with open(filename) as f:
+        for l in f.readlines():
+            l = l.split("#", 1)[0].strip()
+            if not l:
+                continue
+            boards.append(parse_board(l, bind_ip, bind_port + len(boards)))
+    return boards
+
+
+class Board:
+    def __init__(self, args, csr_csv):
+        self.name = args.name
+        self.args = args
+        self.csr_csv = args.csr_csv or csr_csv
+        self.server = None
+        self.wb = None
+        self.identity = None
+        self.lock = threading.Lock()
+
+    def open(self):
+        """Returns the RemoteClient for the board, (re)connecting if needed."""
+        if self.server is None:
+            proxy = start_server(self.args)
+            if proxy is None:
+                raise ConnectionError("Couldn't connect to {}".format(self.name))
+            self.server = proxy.server
+        if self.wb is None:
+            wb = RemoteClient(self.args.bind_ip, int(self.args.bind_port), csr_csv=self.csr_csv)
+            wb.open()
+            dna, git = get_identity(wb)
+            self.identity = {"dna": dna, "git": git, "platform": get_platform(wb)}
+            self.wb = wb
+        return self.wb
+
+    def close(self):
+        """Close the connection and the RemoteServer (and so the comm)."""
+        if self.wb is not None:
+            try:
+                self.wb.close()
+            except OSError:
+                pass
+            self.wb = None
+        if self.server is not None:
+            try:
+                stop_server(self.server)
+            except OSError:
+                pass
+            self.server = None
+
+
+class Farm:
+    def __init__(self, boards):
+        self.boards = boards
+
+    def run_one(self, board, test):
+        result = {"board": board.name, "status": "failed"}
+        start = time.time()
+        # A board only runs one test at a time.
+        with board.lock:
+            try:
+                wb = board.open()
+                result.update(board.identity)
+                result["result"] = test(wb)
+                result["status"] = "ok"
+            except Exception as e:
+                result["error"] = "{}: {}".format(e.__class__.__name__, e)
+                traceback.print_exc()
+                # Start with a fresh server and connection next time.
+                board.close()
+        result["time"] = time.time() - start
+        return result
+
+    def run(self, test, jobs=None):
+        """Run test on every board, returns the results in board order."""
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs or len(self.boards)) as pool:
+            futures = [pool.submit(self.run_one, board, test) for board in self.boards]
+            return [f.result() for f in futures]
+
+    def close(self):
+        for board in self.boards:
+            board.close()
+
+
+def identify(wb):
+    """The default test, just reports the board identity."""
+    return get_platform(wb)
+
+
+def get_test(name):
+    if name is None:
+        return identify
+    module, _, function = name.partition(":")
+    assert function, "Test should be given as module:function, got {!r}".format(name)
+    return getattr(importlib.import_module(module), function)
+
+
+def print_summary(results):
+    print()
+    print("{:20s} {:20s} {:10s} {:30s} {:>8s}  {}".format(
+        "Board", "DNA", "Git", "Platform", "Time", "Status"))
+    print("-"*100)
+    for r in results:
+        print("{:20s} {:20s} {:10s} {:30s} {:>8.1f}  {}".format(
+            r["board"],
+            r.get("dna", "-"),
+            r.get("git", "-")[:10],
+            r.get("platform", "-"),
+            r["time"],
+            r["status"] if r["status"] == "ok" else "{} ({})".format(r["status"], r.get("error", ""))))
+    print("-"*100)
+    failed = len([r for r in results if r["status"] != "ok"])
+    print("{} boards, {} failed".format(len(results), failed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    get_args(parser)
+    parser.add_argument("--boards", required=True,
+                        help="file listing the boards")
+    parser.add_argument("--test", default=None,
+                        help="module:function to run on each board (default: just identify them)")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="boards to test at once (default: all of them)")
+    parser.add_argument("--bind-ip", default="localhost",
+                        help="Host bind address")
+    parser.add_argument("--bind-port", default=1234, type=int,
+                        help="Host bind port for the first board, the others use the following ports")
+    parser.add_argument("--summary", default="build/farm-results.json",
+                        help="where to write the json results")
+    args = parser.parse_args()
+
+    csr_csv = os.path.join(TOP_DIR, get_testdir(args), "csr.csv")
+    farm = Farm([
+        Board(b, csr_csv) for b in read_boards(args.boards, args.bind_ip, args.bind_port)])
+    test = get_test(args.test)
+
+    results = farm.run(test, args.jobs)
+    farm.close()
+    print_summary(results)
+
+    summary_dir = os.path.dirname(args.summary)
+    if summary_dir:
+        os.makedirs(summary_dir, exist_ok=True)
+    with open(args.summary, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True, default=str)
+    print("Results: {}".format(args.summary))
+
+    if [r for r in results if r["status"] != "ok"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
+    main()
@@ -15,7 +15,14 @@ import progressbar
 from common import *
 
 
-def send_int32_data(wb, base, data, b=128):
+# Must match firmware/framebuffer.h
+FRAMEBUFFER_BASE_PATTERN = 0x01000000
+FRAMEBUFFER_SIZE = 0x400000
+FRAMEBUFFER_COUNT = 4
+
+
+def send_int32_data(wb, base, data, b=64*1024):
+    data = numpy.asarray(data, dtype='>u4').ravel()
     l = len(data)
     batches = l/b
     print("Data is {} bytes (need {} batches)".format(l*4, batches))
@@ -23,12 +30,89 @@ def send_int32_data(wb, base, data, b=128):
     bar = progressbar.ProgressBar(max_value=l).start()
     for pos in range(0, l, b):
         mem_loc = base+pos*4
-        wb.write(mem_loc, [int(x) for x in data[pos:pos+b]])
+        bulk_write(wb, mem_loc, data[pos:pos+b])
         bar.update(pos)
 
     bar.finish()
 
 
+def gst_frames(src, width, height):
+    """Run gstreamer and yield each raw UYVY frame as it is produced."""
+    pipeline = """
+gst-launch-1.0 -q \
+    {src} ! \
+    videoconvert ! \
+    video/x-raw,format=UYVY,height={height},width={width},colorimetry=1:4:0:0 ! \
+    fdsink fd=1
+""".format(src=src,
+           width=width,
+           height=height)
+    print(pipeline)
+    frame_size = width*height*2
+    p = subprocess.Popen(pipeline, shell=True, stdout=subprocess.PIPE)
+    try:
+        while True:
+            frame = p.stdout.read(frame_size)
+            if len(frame) < frame_size:
+                break
+            yield numpy.frombuffer(frame, '>u4')
+    finally:
+        p.stdout.close()
+        p.wait()
+
+
+def file_frames(filenames):
+    for fn in filenames:
+        print("Sending {}".format(fn))
+        yield numpy.fromfile(open(fn, 'rb'), '>u4')
+
+
+def live(wb, pattern_offset, frames, buffers, fps=None):
+    """
+    Show frames without tearing by uploading each one into a back buffer
+    and only then flipping the output to it.
+
+    The buffers are the pattern frame buffers (FRAMEBUFFER_SIZE apart). The
+    firmware picks the one to show from the index in the last word of the
+    pattern buffer area (like pcie_in_fb_index), so the index is written
+    there as well as straight into hdmi_out0_core_initiator_base.
+    """
+    assert 2 <= buffers <= FRAMEBUFFER_COUNT, (
+        "Need between 2 and {} buffers".format(FRAMEBUFFER_COUNT))
+    index_mem = wb.mems.main_ram.base + pattern_offset + FRAMEBUFFER_COUNT*FRAMEBUFFER_SIZE - 4
+
+    front = 0
+    period = 1.0/fps if fps else 0
+    start = time.time()
+    next_flip = start
+    sent = 0
+    for i, frame in enumerate(frames):
+        assert len(frame)*4 <= FRAMEBUFFER_SIZE - 4, "Frame too big for the frame buffer!"
+        back = (front + 1) % buffers
+        offset = pattern_offset + back*FRAMEBUFFER_SIZE
+
+        upload = time.time()
+        bulk_write(wb, wb.mems.main_ram.base + offset, frame)
+        upload = time.time() - upload
+
+        now = time.time()
+        if now < next_flip:
+            time.sleep(next_flip - now)
+        next_flip = max(next_flip, now) + period
+
+        wb.write(index_mem, back)
+        wb.regs.hdmi_out0_core_initiator_base.write(offset)
+        front = back
+        sent += len(frame)*4
+
+        print("Frame {:5d} -> buffer {} (0x{:08x}), upload {:.3f}s ({:.2f}MB/s)".format(
+            i, back, offset, upload, len(frame)*4/upload/1e6 if upload else 0))
+
+    total = time.time() - start
+    if total and sent:
+        print("Sent {} frames in {:.1f}s, {:.2f} fps".format(i+1, total, (i+1)/total))
+
+
 def add_args(parser):
     parser.add_argument(
         "--file",
@@ -47,6 +131,24 @@ def add_args(parser):
         help="Number of seconds between sending each frame of the input."
         )
 
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Send frames as gstreamer produces them, rather than via a temporary directory.")
+
+    parser.add_argument(
+        "--live",
+        default=None,
+        type=int,
+        metavar="BUFFERS",
+        help="Play the input as a live feed, double (or triple, ...) buffered in BUFFERS frame buffers.")
+
+    parser.add_argument(
+        "--fps",
+        default=None,
+        type=float,
+        help="With --live, the frame rate to flip at (default: as fast as the frames can be sent).")
+
     parser.add_argument(
         "--pattern",
         default=None,
@@ -69,7 +171,8 @@ def main():
                 continue
 
             pattern_offset = eval(l[len(define):-1])
-        assert pattern_offset != 0
+        if pattern_offset == 0:
+            pattern_offset = FRAMEBUFFER_BASE_PATTERN
 
     pattern_mem = wb.mems.main_ram.base + pattern_offset
 
@@ -91,6 +194,19 @@ def main():
         assert os.path.exists(infile), "{} ({}) does not exist!".format(infile, args.file)
         src = "filesrc location={} ! decodebin ! videoscale".format(infile)
 
+    if args.live and args.stream:
+        live(wb, pattern_offset, gst_frames(src, width, height), args.live, args.fps)
+        return
+
+    if args.stream:
+        for i, frame in enumerate(gst_frames(src, width, height)):
+            if i != 0:
+                print("Sleeping for {} seconds".format(args.delay))
+                time.sleep(args.delay)
+            print("Sending frame {}".format(i))
+            send_int32_data(wb, pattern_mem, frame)
+        return
+
     # Use gstreamer to convert input
     tempdir = None
     try:
@@ -126,11 +242,17 @@ gst-launch-1.0 -v \
         print("-"*75)
         print()
 
+        if args.live:
+            live(wb, pattern_offset,
+                 file_frames(os.path.join(tempdir, fn) for fn in sorted(files)),
+                 args.live, args.fps)
+            return
+
         for i, fn in enumerate(files):
             pn = os.path.join(tempdir, fn)
             print("Sending {}".format(pn))
-            data = numpy.fromfile(open(pn, 'rb'), '>4I')
-            send_int32_data(wb, pattern_mem, data.flat)
+            data = numpy.fromfile(open(pn, 'rb'), '>u4')
+            send_int32_data(wb, pattern_mem, data)
 
             if i != len(files)-1:
                 print("Sleeping for {} seconds".format(args.delay))
@@ -0,0 +1,113 @@
+"""
+CSR write batching for RemoteClient sessions.
+
+Every register write through RemoteClient is its own Etherbone packet.
+Inside `with session.batch():` writes are queued instead, and registers
+next to each other in the CSR map are merged into a single write record, so
+configuring something like a video mode (which writes a bank of adjacent
+registers) is sent as a handful of records rather than one per bus word.
+A read flushes the queued writes first, so the order the board sees the
+accesses in doesn't change.
+
+    session = Session(wb)
+    with session.batch():
+        session.regs.hdmi_out0_core_initiator_hres.write(1280)
+        ...
+"""
+
+from contextlib import contextmanager
+
+from common import datas_to_reg, get_platform, read_static, reg_to_datas, BULK_RECORD_WORDS
+
+
+def coalesce_writes(writes, max_words=BULK_RECORD_WORDS):
+    """
+    Merge (addr, datas) writes which follow on from each other, keeping the
+    order of the writes.
+
+    >>> coalesce_writes([(0x10, [1, 2]), (0x18, [3]), (0x20, [4]), (0x10, [5])])
+    [(16, [1, 2, 3]), (32, [4]), (16, [5])]
+    >>> coalesce_writes([(0, [1, 2]), (8, [3])], max_words=2)
+    [(0, [1, 2]), (8, [3])]
+    """
+    runs = []
+    for addr, datas in writes:
+        if runs:
+            last_addr, last_datas = runs[-1]
+            if (addr == last_addr + 4*len(last_datas)
+                    and len(last_datas) + len(datas) <= max_words):
+                last_datas.extend(datas)
+                continue
+        runs.append((addr, list(datas)))
+    return runs
+
+
+class SessionRegister:
+    def __init__(self, session, reg):
+        self.session = session
+        self.reg = reg
+
+    def read(self):
+        return datas_to_reg(self.reg, self.session.read(self.reg.addr, self.reg.length))
+
+    def write(self, value):
+        self.session.write(self.reg.addr, reg_to_datas(self.reg, value))
+
+    def __getattr__(self, name):
+        return getattr(self.reg, name)
+
+
+class SessionRegisters:
+    def __init__(self, session, regs):
+        self._session = session
+        self._regs = regs
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return SessionRegister(self._session, getattr(self._regs, name))
+
+
+class Session:
+    def __init__(self, wb):
+        self.wb = wb
+        self.regs = SessionRegisters(self, wb.regs)
+        self.mems = wb.mems
+        self._writes = None
+
+    @contextmanager
+    def batch(self):
+        if self._writes is not None:
+            # Already batching
+            yield
+            return
+        self._writes = []
+        try:
+            yield
+        finally:
+            self.flush()
+            self._writes = None
+
+    def flush(self):
+        if not self._writes:
+            return
+        for addr, datas in coalesce_writes(self._writes):
+            self.wb.write(addr, datas)
+        self._writes[:] = []
+
+    def write(self, addr, datas):
+        datas = datas if isinstance(datas, list) else [datas]
+        if self._writes is None:
+            self.wb.write(addr, datas)
+        else:
+            self._writes.append((addr, datas))
+
+    def read(self, addr, length=None):
+        self.flush()
+        return self.wb.read(addr, length)
+
+    def read_static(self, name):
+        return read_static(self.wb, name)
+
+    def get_platform(self):
+        return get_platform(self.wb)
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Measure memory read / write speed through litex_server, one request at a
+time and with the bulk helpers from common.py, over whatever link the
+server uses (run it once with --uart and once with --udp to compare).
+"""
+
+import time
+
+from common import *
+
+
+def timed(f, *args):
+    start = time.time()
+    f(*args)
+    return time.time() - start
+
+
+def single_read(wb, addr, length):
+    for n in range(0, length, BULK_RECORD_WORDS):
+        wb.read(addr + n*4, min(BULK_RECORD_WORDS, length - n))
+
+
+def add_args(parser):
+    parser.add_argument("--region", default="main_ram",
+                        help="memory region to use (default: main_ram)")
+    parser.add_argument("--size", type=lambda x: int(x, 0), default=64*1024,
+                        help="bytes to transfer")
+    parser.add_argument("--write", action="store_true",
+                        help="also measure writes (overwrites the start of the region!)")
+
+
+def main():
+    args, wb = connect(__doc__, add_args=add_args)
+    region = getattr(wb.mems, args.region)
+    length = min(args.size, region.size)//4
+    size_kb = length*4/1024
+
+    print("{} kbytes from {} (0x{:08x})".format(size_kb, args.region, region.base))
+    results = [
+        ("read, one request at a time", timed(single_read, wb, region.base, length)),
+        ("read, 1 in flight", timed(bulk_read_words, wb, region.base, length, 1)),
+        ("read, {} in flight".format(BULK_INFLIGHT), timed(bulk_read_words, wb, region.base, length)),
+    ]
+    if args.write:
+        data = bulk_read_words(wb, region.base, length)
+        results.append(("write", timed(bulk_write, wb, region.base, data)))
+        # Writes have no reply, make sure they reached the board.
+        results[-1] = (results[-1][0], results[-1][1] + timed(wb.read, region.base))
+
+    for name, t in results:
+        print("{:>32s}: {:8.3f}s {:10.1f} kbytes/s".format(name, t, size_kb/t))
+
+    wb.close()
+
+
+if __name__ == "__main__":
+    main()
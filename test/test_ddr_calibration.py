@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Find the DDR read bitslip / delay with the BIST cores (memtest target).
+
+For each bitslip / delay point of the grid the read delays are set, then
+the LiteDRAMBISTGenerator writes a pattern and the LiteDRAMBISTChecker
+reads it back and counts the errors. The whole pass runs in gateware, so a
+point costs a handful of CSR accesses rather than a round trip per word.
+The delay at the centre of the widest passing window is then selected.
+
+The CPU must not be using the main RAM while this runs (stop it in the
+BIOS, before the firmware is loaded).
+"""
+
+import json
+import time
+
+from common import *
+from session import Session
+
+
+def find_window(errors):
+    """
+    The (start, length) of the longest run of zero error counts.
+
+    >>> find_window([5, 0, 0, 1, 0, 0, 0, 0, 2])
+    (4, 4)
+    >>> find_window([1, 2])
+    (0, 0)
+    """
+    best = (0, 0)
+    start = None
+    for i, e in enumerate(list(errors) + [1]):
+        if e == 0 and start is None:
+            start = i
+        elif e != 0 and start is not None:
+            if i - start > best[1]:
+                best = (start, i - start)
+            start = None
+    return best
+
+
+def set_point(session, modules, bitslip, delay):
+    regs = session.regs
+    with session.batch():
+        for k in range(modules):
+            regs.ddrphy_dly_sel.write(1<<k)
+            regs.ddrphy_rdly_dq_rst.write(1)
+            for i in range(bitslip):
+                # 7-series SERDES in DDR mode needs 3 pulses for 1 bitslip
+                for j in range(3):
+                    regs.ddrphy_rdly_dq_bitslip.write(1)
+            for i in range(delay):
+                regs.ddrphy_rdly_dq_inc.write(1)
+
+
+def wait_done(reg, timeout=5):
+    deadline = time.time() + timeout
+    while not reg.read():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.001)
+    return True
+
+
+def bist_pass(session, base, length):
+    """Write and check length DRAM words, returns the error count."""
+    regs = session.regs
+    with session.batch():
+        regs.generator_reset.write(1)
+        regs.generator_reset.write(0)
+        regs.generator_base.write(base)
+        regs.generator_length.write(length)
+        regs.generator_start.write(1)
+    if not wait_done(regs.generator_done):
+        return None
+
+    with session.batch():
+        regs.checker_reset.write(1)
+        regs.checker_reset.write(0)
+        regs.checker_base.write(base)
+        regs.checker_length.write(length)
+        regs.checker_start.write(1)
+    if not wait_done(regs.checker_done):
+        return None
+    return regs.checker_err_count.read()
+
+
+def print_eye(eye, delays):
+    print()
+    print("bitslip | delay 0{}{}".format(" "*(delays-3), delays-1))
+    print("-"*(12+delays))
+    for bitslip, errors in enumerate(eye):
+        print("{:7d} | {}".format(bitslip, "".join(
+            "?" if e is None else ("." if e == 0 else "x") for e in errors)))
+    print()
+
+
+def add_args(parser):
+    parser.add_argument("--bitslips", type=int, default=4,
+                        help="number of bitslip settings to try")
+    parser.add_argument("--delays", type=int, default=32,
+                        help="number of delay taps to try")
+    parser.add_argument("--modules", type=int, default=2,
+                        help="number of DQ byte lanes (ddrphy_dly_sel bits)")
+    parser.add_argument("--test-size", type=int, default=64*1024,
+                        help="bytes written / checked at each point")
+    parser.add_argument("--port-width", type=int, default=128,
+                        help="data width of the DRAM port, in bits")
+    parser.add_argument("--output", default=None,
+                        help="save the eye map and result as json")
+
+
+def main():
+    args, wb = connect(__doc__, target='memtest', add_args=add_args)
+    session = Session(wb)
+    length = (args.test_size*8)//args.port_width
+
+    start = time.time()
+    eye = []
+    for bitslip in range(args.bitslips):
+        errors = []
+        for delay in range(args.delays):
+            set_point(session, args.modules, bitslip, delay)
+            errors.append(bist_pass(session, 0, length))
+        eye.append(errors)
+        window = find_window(errors)
+        print("bitslip {}: widest window {} taps from delay {}".format(bitslip, window[1], window[0]))
+    elapsed = time.time() - start
+
+    print_eye(eye, args.delays)
+
+    windows = [find_window(errors) for errors in eye]
+    bitslip = max(range(len(windows)), key=lambda b: windows[b][1])
+    window_start, window_length = windows[bitslip]
+    if window_length == 0:
+        print("No working bitslip / delay found! ({:.1f}s)".format(elapsed))
+        exit(1)
+
+    delay = window_start + window_length//2
+    set_point(session, args.modules, bitslip, delay)
+    print("Selected bitslip={}, delay={} (window of {} taps), {:.1f}s".format(
+        bitslip, delay, window_length, elapsed))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "dna": get_identity(wb)[0],
+                "eye": eye,
+                "bitslip": bitslip,
+                "delay": delay,
+                "window": window_length,
+            }, f, indent=2)
+
+    wb.close()
+
+
+if __name__ == "__main__":
+    main()
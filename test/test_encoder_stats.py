@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Sample the encoder performance counters (gateware/encoder/stats.py) and
+print the frame rate, frame size and where the encoder spends its time;
+
+- fdct stall: the JpegEnc waiting for pixels, the input (buffer / DRAM) is
+  too slow.
+- out full: the JpegEnc held by its output FIFO, the entropy coded data
+  isn't being taken fast enough.
+- usb bp: the USB streamer not taking data.
+- dma wait: the reader waiting for DRAM.
+
+The stall columns are the percentage of clock cycles.
+"""
+
+import time
+
+from common import *
+
+
+COUNTERS = ("cycles", "frames", "bytes", "frame_bytes", "fdct_stall",
+            "output_full", "usb_backpressure", "sys_cycles", "dma_wait")
+
+
+def sample(wb):
+    wb.regs.encoder_stats_update.write(1)
+    values = {c: getattr(wb.regs, "encoder_stats_" + c).read() for c in COUNTERS}
+    values["time"] = time.time()
+    return values
+
+
+def delta(a, b, name):
+    """Difference between two samples of a (wrapping) 32 bit counter."""
+    return (b[name] - a[name]) & 0xffffffff
+
+
+def rates(a, b):
+    """
+    >>> a = dict(time=0.0, cycles=0, frames=0, bytes=0, frame_bytes=0,
+    ...          fdct_stall=0, output_full=0, usb_backpressure=0,
+    ...          sys_cycles=0xffffff00, dma_wait=0)
+    >>> b = dict(time=2.0, cycles=1000, frames=60, bytes=6000000,
+    ...          frame_bytes=100000, fdct_stall=250, output_full=0,
+    ...          usb_backpressure=100, sys_cycles=0x2e8, dma_wait=100)
+    >>> r = rates(a, b)
+    >>> r["fps"], r["kbytes_per_frame"], r["fdct_stall"], r["usb_bp"], r["dma_wait"]
+    (30.0, 100.0, 25.0, 10.0, 10.0)
+    """
+    elapsed = b["time"] - a["time"]
+    frames = delta(a, b, "frames")
+    cycles = max(delta(a, b, "cycles"), 1)
+    sys_cycles = max(delta(a, b, "sys_cycles"), 1)
+    return {
+        "fps": frames/elapsed,
+        "mbytes_per_s": delta(a, b, "bytes")/elapsed/1e6,
+        "kbytes_per_frame": (delta(a, b, "bytes")/frames if frames else b["frame_bytes"])/1e3,
+        "fdct_stall": 100*delta(a, b, "fdct_stall")/cycles,
+        "output_full": 100*delta(a, b, "output_full")/cycles,
+        "usb_bp": 100*delta(a, b, "usb_backpressure")/cycles,
+        "dma_wait": 100*delta(a, b, "dma_wait")/sys_cycles,
+    }
+
+
+def add_args(parser):
+    parser.add_argument("--interval", type=float, default=1.0,
+                        help="seconds between samples")
+    parser.add_argument("--count", type=int, default=0,
+                        help="number of samples to print (default: until interrupted)")
+
+
+def main():
+    args, wb = connect(__doc__, target='hdmi2usb', add_args=add_args)
+
+    print("{:>7s} {:>8s} {:>10s} {:>11s} {:>9s} {:>8s} {:>9s}".format(
+        "fps", "MB/s", "kB/frame", "fdct stall", "out full", "usb bp", "dma wait"))
+    print("-"*70)
+    last = sample(wb)
+    n = 0
+    try:
+        while not args.count or n < args.count:
+            time.sleep(args.interval)
+            s = sample(wb)
+            r = rates(last, s)
+            print("{fps:7.2f} {mbytes_per_s:8.2f} {kbytes_per_frame:10.1f} "
+                  "{fdct_stall:10.1f}% {output_full:8.1f}% {usb_bp:7.1f}% {dma_wait:8.1f}%".format(**r))
+            last = s
+            n += 1
+    except KeyboardInterrupt:
+        pass
+
+    wb.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,49 +2,56 @@ import time
 
 from litex.tools.litex_client import RemoteClient
 
+from session import Session
+
 wb = RemoteClient(debug=True)
 wb.open()
-regs = wb.regs
+session = Session(wb)
+regs = session.regs
 
 
 def config_1080p60(bpp):
-    write_mmcm_reg(0x8, 0x1000 + (2 << 6) + 3)
-    write_mmcm_reg(0xa, 0x1000 + (1 << 6) + 1)
+    # One batch, so the whole mode is set in a few Etherbone records.
+    with session.batch():
+        write_mmcm_reg(0x8, 0x1000 + (2 << 6) + 3)
+        write_mmcm_reg(0xa, 0x1000 + (1 << 6) + 1)
 
-    regs.hdmi_out0_core_initiator_hres.write(1920)
-    regs.hdmi_out0_core_initiator_hsync_start.write(1920+88)
-    regs.hdmi_out0_core_initiator_hsync_end.write(1920+88+44)
-    regs.hdmi_out0_core_initiator_hscan.write(2200)
+        regs.hdmi_out0_core_initiator_hres.write(1920)
+        regs.hdmi_out0_core_initiator_hsync_start.write(1920+88)
+        regs.hdmi_out0_core_initiator_hsync_end.write(1920+88+44)
+        regs.hdmi_out0_core_initiator_hscan.write(2200)
 
-    regs.hdmi_out0_core_initiator_vres.write(1080)
-    regs.hdmi_out0_core_initiator_vsync_start.write(1080+4)
-    regs.hdmi_out0_core_initiator_vsync_end.write(1080+4+5)
-    regs.hdmi_out0_core_initiator_vscan.write(1125)
+        regs.hdmi_out0_core_initiator_vres.write(1080)
+        regs.hdmi_out0_core_initiator_vsync_start.write(1080+4)
+        regs.hdmi_out0_core_initiator_vsync_end.write(1080+4+5)
+        regs.hdmi_out0_core_initiator_vscan.write(1125)
 
-    regs.hdmi_out0_core_initiator_enable.write(0)
-    regs.hdmi_out0_core_initiator_base.write(0)
-    regs.hdmi_out0_core_initiator_length.write(1920*1080*bpp)
-    regs.hdmi_out0_core_initiator_enable.write(1)
+        regs.hdmi_out0_core_initiator_enable.write(0)
+        regs.hdmi_out0_core_initiator_base.write(0)
+        regs.hdmi_out0_core_initiator_length.write(1920*1080*bpp)
+        regs.hdmi_out0_core_initiator_enable.write(1)
 
 
 def config_720p60(bpp):
-    write_mmcm_reg(0x8, 0x1000 + (4 << 6)  + 6)
-    write_mmcm_reg(0xa, 0x1000 + (2  << 6) + 2)
-
-    regs.hdmi_out0_core_initiator_hres.write(1280)
-    regs.hdmi_out0_core_initiator_hsync_start.write(1390)
-    regs.hdmi_out0_core_initiator_hsync_end.write(1430)
-    regs.hdmi_out0_core_initiator_hscan.write(1650)
-
-    regs.hdmi_out0_core_initiator_vres.write(720)
-    regs.hdmi_out0_core_initiator_vsync_start.write(725)
-    regs.hdmi_out0_core_initiator_vsync_end.write(730)
-    regs.hdmi_out0_core_initiator_vscan.write(750)
-
-    regs.hdmi_out0_core_initiator_enable.write(0)
-    regs.hdmi_out0_core_initiator_base.write(0)
-    regs.hdmi_out0_core_initiator_length.write(1280*720*bpp)
-    regs.hdmi_out0_core_initiator_enable.write(1)
+    # One batch, so the whole mode is set in a few Etherbone records.
+    with session.batch():
+        write_mmcm_reg(0x8, 0x1000 + (4 << 6)  + 6)
+        write_mmcm_reg(0xa, 0x1000 + (2  << 6) + 2)
+
+        regs.hdmi_out0_core_initiator_hres.write(1280)
+        regs.hdmi_out0_core_initiator_hsync_start.write(1390)
+        regs.hdmi_out0_core_initiator_hsync_end.write(1430)
+        regs.hdmi_out0_core_initiator_hscan.write(1650)
+
+        regs.hdmi_out0_core_initiator_vres.write(720)
+        regs.hdmi_out0_core_initiator_vsync_start.write(725)
+        regs.hdmi_out0_core_initiator_vsync_end.write(730)
+        regs.hdmi_out0_core_initiator_vscan.write(750)
+
+        regs.hdmi_out0_core_initiator_enable.write(0)
+        regs.hdmi_out0_core_initiator_base.write(0)
+        regs.hdmi_out0_core_initiator_length.write(1280*720*bpp)
+        regs.hdmi_out0_core_initiator_enable.write(1)
 
     #regs.hdmi_out0_core_initiator_base.write(0x02000000)
     #regs.hdmi_out0_core_initiator_length.write(1280*720*bpp)
@@ -10,11 +10,81 @@ from common import *
 MemError = namedtuple("MemError", ("address", "expected", "actual"))
 
 
+def bist_run(wb, name, base, length, timeout=60):
+    """Run the generator or checker over length DRAM words, returns the cycles taken."""
+    reg = lambda r: getattr(wb.regs, "{}_{}".format(name, r))
+    reg("reset").write(1)
+    reg("reset").write(0)
+    reg("base").write(base)
+    reg("length").write(length)
+    reg("start").write(1)
+    deadline = time.time() + timeout
+    while not reg("done").read():
+        assert time.time() < deadline, "{} didn't finish in {}s".format(name, timeout)
+        time.sleep(0.001)
+    return getattr(wb.regs, "bist_timer_{}_cycles".format(name)).read()
+
+
+def sweep(args, wb):
+    """Write and check all of main_ram in chunks, reporting the bandwidth."""
+    main_ram = wb.mems.main_ram
+    clk_freq = wb.regs.bist_timer_clk_freq.read()
+    word_bytes = args.port_width//8
+    chunk_size = min(args.chunk_size, main_ram.size)
+    assert chunk_size % word_bytes == 0, "Chunk size must be a multiple of {} bytes".format(word_bytes)
+
+    print("Sweeping {} Mbytes in {} kbyte chunks ({} MHz)".format(
+        main_ram.size//(1024*1024), chunk_size//1024, clk_freq/1e6))
+    print()
+    print("{:>10s} {:>12s} {:>12s} {:>8s}".format("Address", "Write MB/s", "Read MB/s", "Errors"))
+    print("-"*45)
+
+    results = []
+    for offset in range(0, main_ram.size, chunk_size):
+        size = min(chunk_size, main_ram.size - offset)
+        base, length = offset//word_bytes, size//word_bytes
+        write_cycles = bist_run(wb, "generator", base, length)
+        read_cycles = bist_run(wb, "checker", base, length)
+        errors = wb.regs.checker_err_count.read()
+        results.append((size, write_cycles, read_cycles, errors))
+        print("0x{:08x} {:12.1f} {:12.1f} {:8d}".format(
+            main_ram.base + offset,
+            size*clk_freq/max(write_cycles, 1)/1e6,
+            size*clk_freq/max(read_cycles, 1)/1e6,
+            errors))
+
+    total = sum(r[0] for r in results)
+    write_cycles = sum(r[1] for r in results)
+    read_cycles = sum(r[2] for r in results)
+    errors = sum(r[3] for r in results)
+    print("-"*45)
+    print("{:>10s} {:12.1f} {:12.1f} {:8d}".format(
+        "Total",
+        total*clk_freq/max(write_cycles, 1)/1e6,
+        total*clk_freq/max(read_cycles, 1)/1e6,
+        errors))
+    return errors
+
+
+def add_args(parser):
+    parser.add_argument("--sweep", action="store_true",
+                        help="Test all of main_ram and report the bandwidth")
+    parser.add_argument("--chunk-size", type=lambda x: int(x, 0), default=16*1024*1024,
+                        help="Bytes tested by each generator / checker run with --sweep")
+    parser.add_argument("--port-width", type=int, default=128,
+                        help="Data width of the DRAM port, in bits")
+
+
 def main():
-    args, wb = connect("LiteX Etherbone Memtest BIST", target='memtest')
+    args, wb = connect("LiteX Etherbone Memtest BIST", target='memtest', add_args=add_args)
     print_memmap(wb)
     print()
 
+    if args.sweep:
+        errors = sweep(args, wb)
+        wb.close()
+        exit(1 if errors else 0)
+
     main_ram = wb.mems.main_ram
     print("DDR at 0x{:x} -- {} Megabytes".format(main_ram.base, int(main_ram.size/(1024*1024))))
     print()